@@ -0,0 +1,66 @@
+"""Measures the cost of logging in the fuzzing loop, comparing the transactions per second
+at a log level (INFO, the default -l 2) with the transactions per second with logging disabled.
+
+Usage:
+    python3 benchmarks/logging_overhead.py [-f FILE] [-n BLOCKS] [-tx TRANSACTIONS] [-l LEVEL] [-r REPEAT]
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+from random import Random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "gas_fuzz"))
+
+from gas_fuzz import chain_class_for, configure_logging, process_and_compile
+
+
+def transactions_per_second(compiled, blocks, txs):
+    # The same seed in both runs, so they execute the same transactions
+    # Trusted transactions skip signing, which would otherwise drown the cost of logging
+    chain = chain_class_for(None, trusted_transactions=True).init(
+        compiled['contracts'], ast=compiled['sources'], tx=txs, rng=Random(0))
+
+    start = time.perf_counter()
+    for _ in range(blocks):
+        chain.fuzz()
+
+    return blocks * txs / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure transactions per second with and without logging.")
+    parser.add_argument("-f", "--file", default=os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), os.pardir, "sample-solidity", "counter.sol"),
+                        help="solidity file to fuzz")
+    parser.add_argument("-n", "--blocks", type=int, default=20,
+                        help="number of blocks to mine in each mode")
+    parser.add_argument("-tx", "--block-tx", type=int, default=10,
+                        help="number of transactions per block")
+    parser.add_argument("-l", "--log", type=int, default=2,
+                        help="log level to measure, as in gas_fuzz (default INFO)")
+    parser.add_argument("-r", "--repeat", type=int, default=3,
+                        help="number of runs in each mode, the best one is reported")
+    args = parser.parse_args()
+
+    configure_logging(args.log)
+    compiled = process_and_compile(args.file, None)
+
+    # Modes alternate, so both are equally affected by anything else running
+    logged = silent = 0
+    for _ in range(args.repeat):
+        logging.disable(logging.NOTSET)
+        logged = max(logged, transactions_per_second(compiled, args.blocks, args.block_tx))
+
+        logging.disable(logging.CRITICAL)
+        silent = max(silent, transactions_per_second(compiled, args.blocks, args.block_tx))
+
+    print(f"Log level {args.log}:      {logged:8.2f} tx/s")
+    print(f"Logging disabled: {silent:8.2f} tx/s")
+    print(f"Overhead:         {(silent / logged - 1) * 100:8.2f}%")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+"""Compares the blocks per second of a FuzzingChain with and without proof of work sealing.
+
+Usage:
+    python3 benchmarks/seal_blocks.py [-n BLOCKS] [-tx TRANSACTIONS]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "gas_fuzz"))
+
+from eth.vm import forks
+
+from fuzzing_chain import FuzzingChain
+
+
+def blocks_per_second(mine_pow, blocks, txs):
+    # A chain without contracts, the blocks are filled with transfers from the faucet
+    chain = FuzzingChain.configure_fork(forks.ByzantiumVM, mine_pow=mine_pow).init({}, {}, tx=txs)
+    _, pk = chain.fuzzer.accounts[0]
+
+    start = time.perf_counter()
+    for _ in range(blocks):
+        for _ in range(txs):
+            chain.transfer_from_faucet(pk, 1)
+        chain.seal_block()
+
+    return blocks / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure blocks per second with and without proof of work.")
+    parser.add_argument("-n", "--blocks", type=int, default=20,
+                        help="number of blocks to mine in each mode")
+    parser.add_argument("-tx", "--block-tx", type=int, default=10,
+                        help="number of transactions per block")
+    args = parser.parse_args()
+
+    with_pow = blocks_per_second(True, args.blocks, args.block_tx)
+    without_pow = blocks_per_second(False, args.blocks, args.block_tx)
+
+    print(f"Proof of work:    {with_pow:8.2f} blocks/s")
+    print(f"Without seal:     {without_pow:8.2f} blocks/s")
+    print(f"Speedup:          {without_pow / with_pow:8.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+"""Compares the transactions per second of a FuzzingChain with signed and with trusted transactions.
+
+Usage:
+    python3 benchmarks/transactions.py [-n BLOCKS] [-tx TRANSACTIONS]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "gas_fuzz"))
+
+from eth.vm import forks
+
+from fuzzing_chain import FuzzingChain
+
+
+def transactions_per_second(trusted_transactions, blocks, txs):
+    # A chain without contracts, the blocks are filled with transfers from the faucet
+    chain = FuzzingChain.configure_fork(
+        forks.ByzantiumVM, trusted_transactions=trusted_transactions).init({}, {}, tx=txs)
+    _, pk = chain.fuzzer.accounts[0]
+
+    start = time.perf_counter()
+    for _ in range(blocks):
+        for _ in range(txs):
+            chain.transfer_from_faucet(pk, 1)
+        chain.seal_block()
+
+    return blocks * txs / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure transactions per second with signed and with trusted transactions.")
+    parser.add_argument("-n", "--blocks", type=int, default=20,
+                        help="number of blocks to mine in each mode")
+    parser.add_argument("-tx", "--block-tx", type=int, default=10,
+                        help="number of transactions per block")
+    args = parser.parse_args()
+
+    signed = transactions_per_second(False, args.blocks, args.block_tx)
+    trusted = transactions_per_second(True, args.blocks, args.block_tx)
+
+    print(f"Signed:           {signed:8.2f} tx/s")
+    print(f"Trusted:          {trusted:8.2f} tx/s")
+    print(f"Speedup:          {trusted / signed:8.2f}x")
+
+
+if __name__ == '__main__':
+    main()
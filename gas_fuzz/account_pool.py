@@ -0,0 +1,62 @@
+from collections import deque
+
+from eth_keys import keys
+from eth_typing import Address
+
+# Default size of the pool of each simulation
+MAX_ACCOUNTS = 100
+
+
+class AccountPool():
+    '''Accounts for the fuzzer to send transactions from, derived before fuzzing.
+    Accounts are kept as (private key bytes, address) pairs, which are cheap to copy into forks,
+    and their PrivateKey is only built once the account is taken.
+    Each account is handed out once, so the pool size caps the number of accounts of a simulation.
+    Accounts in balances were already funded with that balance, in the genesis state of the chain.
+    '''
+    def __init__(self, accounts=(), balances=None):
+        self.accounts = deque(accounts)
+        self.balances = dict(balances) if balances else {}
+
+    @classmethod
+    def generate(cls, size, rng, exclude=()):
+        '''Derives size accounts with distinct private keys drawn from rng.
+        exclude holds the private keys, as bytes, that must not be drawn.
+        '''
+        drawn = set(exclude)
+        secrets = []
+        while len(secrets) < size:
+            secret = rng.randint(1, 2 ** 32 - 1).to_bytes(32, byteorder='big')
+            if secret not in drawn:
+                drawn.add(secret)
+                secrets.append(secret)
+
+        return cls(cls.derive(secret) for secret in secrets)
+
+    @staticmethod
+    def derive(secret):
+        return secret, Address(keys.PrivateKey(secret).public_key.to_canonical_address())
+
+    def fund(self, rng, max_balance):
+        '''Draws the balance of every account in the pool, and returns the genesis state that funds them
+        '''
+        self.balances = {pk: rng.randint(0, max_balance) for _, pk in self.accounts}
+        return {
+            pk: {
+                'balance': balance,
+                'nonce': 0,
+                'code': b'',
+                'storage': {}
+            } for pk, balance in self.balances.items()
+        }
+
+    def take(self):
+        '''Returns the next account of the pool as a (PrivateKey, address) pair, or None if all were taken
+        '''
+        if not self.accounts:
+            return None
+        secret, pk = self.accounts.popleft()
+        return keys.PrivateKey(secret), pk
+
+    def __len__(self):
+        return len(self.accounts)
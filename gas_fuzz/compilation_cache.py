@@ -0,0 +1,76 @@
+import hashlib
+import json
+import os
+import tempfile
+
+
+class CompilationCache():
+    '''On-disk cache of solc standard-json outputs.
+    Entries are addressed by a hash of everything that affects the compilation,
+    and the least recently used ones are evicted once the cache outgrows max_size bytes.
+    '''
+    def __init__(self, folder, max_size=256 * 2 ** 20):
+        self.folder = folder
+        self.max_size = max_size
+
+        os.makedirs(folder, exist_ok=True)
+
+    @staticmethod
+    def key(*parts):
+        '''Hashes the given strings or bytes into a cache key
+        '''
+        digest = hashlib.sha256()
+        for part in parts:
+            if type(part) is str:
+                part = part.encode('utf-8')
+            # Prefix each part with its length, so different splits of the same bytes don't collide
+            digest.update(len(part).to_bytes(8, byteorder='big'))
+            digest.update(part)
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.folder, f"{key}.json")
+
+    def get(self, key):
+        '''Returns the cached output for key, or None if it isn't cached
+        '''
+        path = self.path(key)
+        try:
+            with open(path) as entry:
+                output = json.load(entry)
+            # Mark the entry as recently used
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+
+        return output
+
+    def put(self, key, output):
+        # Write to a temporary file first, so concurrent runs never read a partial entry
+        fd, temp_path = tempfile.mkstemp(dir=self.folder, suffix=".tmp")
+        with os.fdopen(fd, "w") as entry:
+            json.dump(output, entry)
+        os.replace(temp_path, self.path(key))
+
+        self.evict()
+
+    def evict(self):
+        '''Removes the least recently used entries until the cache fits in max_size
+        '''
+        entries = []
+        for entry in os.scandir(self.folder):
+            if entry.name.endswith(".json"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total_size = sum(size for _, size, _ in entries)
+
+        for _, size, path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                # Already evicted by another run
+                pass
+            total_size -= size
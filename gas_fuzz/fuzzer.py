@@ -1,11 +1,10 @@
 from eth_abi import encode_single
-from eth_keys import keys
-from eth_typing import Address
 
 from type_fuzzing.utils import fuzzer_from_type
+from type_fuzzing.numeric import NumericTypeFuzzer
 from parsing.rule_parser import parse_rules
 
-from random import random, randint, choice
+from random import Random
 import json
 
 from pprint import pprint
@@ -16,12 +15,23 @@ import logging
 class SolidityFuzzer():
     def __init__(self,
                  faucet_callback,
+                 account_pool,
                  faucet_sk=None,
                  new_account_chance=0.25,
                  max_balance=1000,
-                 rules=None):
+                 rules=None,
+                 accounts=None,
+                 balances=None,
+                 rng=None,
+                 prefetch=64):
         self.max_balance = max_balance
 
+        # Source of every random choice of this fuzzer and its type fuzzers
+        self.rng = rng if rng is not None else Random()
+
+        # Number of values generated at once by type fuzzers that support it (0 disables it)
+        self.prefetch = prefetch
+
         self.rules = None
         if rules:
             with open(rules) as rule_file:
@@ -37,11 +47,19 @@ class SolidityFuzzer():
 
         self.faucet_callback = faucet_callback
 
+        # Accounts not used yet
+        self.account_pool = account_pool
+
         self.accounts = []
 
         self.balances = {}
 
-        self.new_account()
+        if accounts:
+            # Accounts restored from a snapshot are already funded
+            self.accounts = list(accounts)
+            self.balances = dict(balances)
+        else:
+            self.new_account()
 
     def register_contract(self, contract_name, variables):
         self.contracts[contract_name] = {
@@ -113,14 +131,21 @@ class SolidityFuzzer():
                 contract_state_vars=[
                     var for var, _type in self.contracts[contract]['variables']
                 ],
+                rng=self.rng,
             )
 
             self.add_type_fuzzer(contract, function, _type, name, fuzzer)
 
-        logging.debug(
-            f"Generating arguments for {contract}.{function} ({_type} {name})...")
+        if logging.root.isEnabledFor(logging.DEBUG):
+            logging.debug(
+                f"Generating arguments for {contract}.{function} ({_type} {name})...")
+
+        fuzzer = self.get_type_fuzzer(contract, function, _type, name)
+
+        if self.prefetch and isinstance(fuzzer, NumericTypeFuzzer) and fuzzer.prefetchable():
+            return fuzzer.next_prefetched(self.prefetch)
 
-        return self.get_type_fuzzer(contract, function, _type, name).next_valid()
+        return fuzzer.next_valid()
 
     def add_type_fuzzer(self, contract, function, _type, name, fuzzer):
         if contract not in self.type_fuzzers:
@@ -148,30 +173,25 @@ class SolidityFuzzer():
             return None
 
     def get_account(self):
-        if random() < self.prob['new_account']:
+        if self.rng.random() < self.prob['new_account'] and self.account_pool:
             return self.new_account()
-        return choice(self.accounts)
+        return self.rng.choice(self.accounts)
 
     def new_account(self):
-        while True:
-            sk = keys.PrivateKey(
-                randint(1, 2 ** 32 - 1).to_bytes(32, byteorder='big'))
+        '''Takes the next account of the pool, and funds it from the faucet unless it was funded in genesis
+        '''
+        account = self.account_pool.take()
+        if account is None:
+            raise ValueError("The account pool is exhausted")
+        _, pk = account
 
-            breakable = not sk == self.faucet_sk
-            for ac_sk, _ in self.accounts:
-                breakable = breakable and not ac_sk == sk
-
-            if breakable:
-                break
-
-        pk = Address(sk.public_key.to_canonical_address())
-
-        account = (sk, pk)
         self.accounts.append(account)
 
-        self.balances[pk] = randint(0, self.max_balance)
-
-        self.faucet_callback(pk, self.balances[pk])
+        if pk in self.account_pool.balances:
+            self.balances[pk] = self.account_pool.balances[pk]
+        else:
+            self.balances[pk] = self.rng.randint(0, self.max_balance)
+            self.faucet_callback(pk, self.balances[pk])
 
         return account
 
@@ -180,6 +200,6 @@ class SolidityFuzzer():
         del self.balances[account[1]]
 
     def randvalue(self, pk):
-        value = randint(0, self.balances[pk])
+        value = self.rng.randint(0, self.balances[pk])
         self.balances[pk] -= value
         return value
@@ -1,8 +1,10 @@
 from eth import constants
 from eth.chains.base import MiningChain
 from eth.db.atomic import AtomicDB
+from eth.db.backends.memory import MemoryDB
 from eth.consensus.pow import mine_pow_nonce
 from eth.exceptions import VMError, Revert
+from eth.vm.spoof import SpoofTransaction
 
 from eth_typing import Address
 from eth_utils import decode_hex, to_wei
@@ -10,8 +12,9 @@ from eth_keys import keys
 
 from eth_abi import decode_abi, decode_single
 
-from random import choice, randint
+from random import Random
 
+from account_pool import AccountPool, MAX_ACCOUNTS
 from fuzzer import SolidityFuzzer
 from fuzzing_data import FuzzingData
 from fuzzing_rules.constraint_parsing import new_constraint
@@ -25,11 +28,147 @@ from functools import reduce
 import logging
 
 
+# Level of the logs of every transaction, named CHAIN DEBUG when logging is configured
+CHAIN_DEBUG = 0
+
+def call_outcome(computation):
+    '''Classifies the result of a call as 'success', 'revert' or 'error'
+    '''
+    try:
+        computation.raise_if_error()
+        return 'success'
+    except Revert:
+        return 'revert'
+    except VMError:
+        return 'error'
+
+
+# Subclasses of the transaction class of each fork, for trusted transactions
+_trusted_transaction_classes = {}
+
+
+def trusted_transaction_class(transaction_class):
+    '''Returns a subclass of transaction_class for transactions that are built by the fuzzer itself, and aren't signed.
+    The sender is stored in place of the r value of the signature, so it is read back instead of recovered,
+    and the signature isn't checked.
+    '''
+    if transaction_class not in _trusted_transaction_classes:
+        class TrustedTransaction(transaction_class):
+            def check_signature_validity(self):
+                pass
+
+            def get_sender(self):
+                return Address(self.r.to_bytes(20, byteorder='big'))
+
+        TrustedTransaction.__name__ = f'Trusted{transaction_class.__name__}'
+        _trusted_transaction_classes[transaction_class] = TrustedTransaction
+
+    return _trusted_transaction_classes[transaction_class]
+
+
+# Subclasses of the computation class of each fork, for opcode profiling
+_profiling_computation_classes = {}
+
+
+def profiling_computation_class(computation_class):
+    '''Returns a subclass of computation_class that records the opcodes run by the code of each transaction.
+    Its opcode functions are wrapped to store each opcode in the opcode_costs of the outermost computation,
+    as a (pc, mnemonic, gas) tuple, leaving the execution loop of py-evm as is.
+    Nested calls run unprofiled, their gas is part of the opcode that made them.
+    The code deposit of a contract creation is charged after its code runs, so it isn't part of any opcode.
+    '''
+    if computation_class not in _profiling_computation_classes:
+        class ProfilingComputation(computation_class):
+            opcodes = {
+                opcode: profiled_opcode(opcode_fn) for opcode, opcode_fn in computation_class.opcodes.items()
+            }
+
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, **kwargs)
+                self.opcode_costs = []
+
+            def get_opcode_fn(self, opcode):
+                opcode_fn = super().get_opcode_fn(opcode)
+                # Undefined opcodes are built on demand
+                return opcode_fn if opcode in self.opcodes else profiled_opcode(opcode_fn)
+
+        ProfilingComputation.__name__ = f'Profiling{computation_class.__name__}'
+        _profiling_computation_classes[computation_class] = ProfilingComputation
+
+    return _profiling_computation_classes[computation_class]
+
+
+def profiled_opcode(opcode_fn):
+    '''Wraps an opcode function to record its pc and gas in the opcode_costs of its computation
+    '''
+    def profiled(computation):
+        if computation.msg.depth > 0:
+            return opcode_fn(computation=computation)
+
+        pc = max(0, computation.code.pc - 1)
+        gas_remaining = computation.get_gas_remaining()
+        try:
+            return opcode_fn(computation=computation)
+        finally:
+            computation.opcode_costs.append((pc, opcode_fn.mnemonic, gas_remaining - computation.get_gas_remaining()))
+
+    profiled.mnemonic = opcode_fn.mnemonic
+    return profiled
+
+
 class FuzzingChain(MiningChain):
+    # Seal blocks with a proof of work. Without it, the VMs must be configured to skip seal validation
+    mine_pow = False
+    # Send transactions without signing them or recovering their senders
+    trusted_transactions = False
+    # Register the gas used by every opcode of each call
+    profile_opcodes = False
+
+    @classmethod
+    def configure_fork(cls, fork, mine_pow=False, trusted_transactions=False, profile_opcodes=False):
+        '''Returns a FuzzingChain class that runs the given VM fork from genesis.
+        '''
+        if not mine_pow:
+            fork = fork.configure(
+                __name__=f'{fork.__name__}WithoutSeal',
+                validate_seal=classmethod(lambda vm_class, header: None)
+            )
+
+        if profile_opcodes:
+            state_class = fork.get_state_class()
+            fork = fork.configure(
+                __name__=f'{fork.__name__}Profiling',
+                _state_class=state_class.configure(
+                    __name__=f'{state_class.__name__}Profiling',
+                    computation_class=profiling_computation_class(state_class.computation_class)
+                )
+            )
+
+        return cls.configure(
+            __name__='Fuzzing Chain',
+            vm_configuration=(
+                (constants.GENESIS_BLOCK_NUMBER, fork),
+            ),
+            mine_pow=mine_pow,
+            trusted_transactions=trusted_transactions,
+            profile_opcodes=profile_opcodes
+        )
+
     @classmethod
-    def init(cls, contracts, ast, tx=10, progress=None, **kwargs):
+    def init(cls, contracts, ast, tx=10, progress=None, snapshot=None, rng=None, fuzzing_data=None, max_accounts=MAX_ACCOUNTS, genesis_accounts=False, max_balance=1000, trace=None, retry_threshold=None, max_retries=5, **kwargs):
         '''Builds a new MiningChain, with the given contract bytecodes, and an AtomicDB database.
+        If a ChainSnapshot is given, the chain is forked from it instead of deploying the contracts again.
+        The fuzzer sends transactions from at most max_accounts accounts, derived up front.
+        With genesis_accounts, they are funded in the genesis state instead of by the faucet when first used.
+        All random choices are drawn from rng, a random.Random instance, so seeding it makes the chain reproducible.
+        Results are registered in fuzzing_data, or in a new FuzzingData if none is given.
+        Every fuzzed call is recorded in trace, a TraceWriter, if one is given.
+        With a retry_threshold, a reverted call is retried with new arguments, up to max_retries times,
+        while more than that fraction of the calls of its function revert.
         '''
+        if rng is None:
+            rng = Random()
+
         GENESIS_PARAMS = {
             'parent_hash': constants.GENESIS_PARENT_HASH,
             'uncles_hash': constants.EMPTY_UNCLE_HASH,
@@ -44,8 +183,13 @@ class FuzzingChain(MiningChain):
             'nonce': constants.GENESIS_NONCE
         }
 
-        sk = keys.PrivateKey(
-            randint(1, 2 ** 32 - 1).to_bytes(32, byteorder='big'))
+        if snapshot is None:
+            sk = keys.PrivateKey(
+                rng.randint(1, 2 ** 32 - 1).to_bytes(32, byteorder='big'))
+            account_pool = AccountPool.generate(max(1, max_accounts), rng, exclude=[sk.to_bytes()])
+        else:
+            sk = keys.PrivateKey(snapshot.faucet_sk)
+            account_pool = AccountPool(snapshot.get_account_pool(), snapshot.account_pool_balances)
         pk = Address(sk.public_key.to_canonical_address())
 
         _faucet = {
@@ -63,19 +207,37 @@ class FuzzingChain(MiningChain):
             }
         }
 
-        chain = cls.from_genesis(AtomicDB(), GENESIS_PARAMS, GENESIS_STATE)
+        if genesis_accounts and snapshot is None:
+            GENESIS_STATE.update(account_pool.fund(rng, max_balance))
+
+        if snapshot is None:
+            chain = cls.from_genesis(AtomicDB(), GENESIS_PARAMS, GENESIS_STATE)
+        else:
+            # Copying the key-value store is enough to fork the whole chain
+            chain = cls(AtomicDB(MemoryDB(dict(snapshot.db))))
 
         chain._faucet = _faucet
+        chain.rng = rng
+        # Values of state variables read since the last change of state, by (contract, variable)
+        chain.state_reads = {}
         logging.log(0, f"Faucet initialized at address: {pk}")
 
         chain.fuzzer = SolidityFuzzer(
             chain.transfer_from_faucet,
+            account_pool,
             faucet_sk=_faucet['sk'],
+            accounts=snapshot.get_accounts() if snapshot else None,
+            balances=snapshot.balances if snapshot else None,
+            rng=rng,
+            max_balance=max_balance,
             **kwargs
         )
 
-        chain.fuzzing_data = FuzzingData()
+        chain.fuzzing_data = fuzzing_data if fuzzing_data is not None else FuzzingData()
         chain.progress = progress
+        chain.trace = trace
+        chain.retry_threshold = retry_threshold
+        chain.max_retries = max_retries
 
         # Number of transactions per block
         chain.txs = tx
@@ -189,23 +351,30 @@ class FuzzingChain(MiningChain):
                     chain.fuzzer.register_function(
                         contract_name, name, parameters, constraints)
 
-                constructor = [abi for abi in desc['abi']
-                               if abi['type'] == 'constructor'][0]
-                call = chain.fuzzer.generate_args(contract_name, '__constructor__', [
-                                                  arg for arg in constructor['inputs']], value=False)
-
-                _, _, computation = chain.call_function(
-                    constants.CREATE_CONTRACT_ADDRESS,
-                    decode_hex(desc['evm']['bytecode']['object']),
-                    call
-                )
-
-                chain.log_function_call(
-                    contract_name, f"constructor", call['pk'], call['args'], call['value'], computation.get_gas_used())
                 chain.fuzzing_data.set_expected_cost(
                     contract_name, f"constructor", desc['evm']['gasEstimates']['creation']['totalCost'])
 
-                contract_address = computation.msg.storage_address
+                if snapshot is None:
+                    constructor = [abi for abi in desc['abi']
+                                   if abi['type'] == 'constructor'][0]
+                    call = chain.fuzzer.generate_args(contract_name, '__constructor__', [
+                                                      arg for arg in constructor['inputs']], value=False)
+
+                    _, _, computation = chain.call_function(
+                        constants.CREATE_CONTRACT_ADDRESS,
+                        decode_hex(desc['evm']['bytecode']['object']),
+                        call
+                    )
+
+                    chain.log_function_call(
+                        contract_name, f"constructor", call['pk'], call['args'], call['value'], computation.get_gas_used(),
+                        call_outcome(computation))
+                    if chain.profile_opcodes:
+                        chain.fuzzing_data.register_opcodes(contract_name, f"constructor", computation.opcode_costs)
+
+                    contract_address = computation.msg.storage_address
+                else:
+                    contract_address = snapshot.addresses[contract_name]
 
                 chain.fuzzer.set_contract_address(
                     contract_name, contract_address)
@@ -232,16 +401,19 @@ class FuzzingChain(MiningChain):
                         [arg['type'] for arg in fout]
                     )
 
+                    read_only = abi['stateMutability'] == 'view' or abi['stateMutability'] == 'pure'
+
                     chain.fuzzer.set_mutability(
                         contract_name,
                         fname,
-                        abi['stateMutability'] == 'view' or abi['stateMutability'] == 'pure'
+                        read_only
                     )
 
                     chain.contracts[contract_address][fname] = {
                         'in': fin,
                         'out': fout,
-                        'payable': abi['payable']
+                        'payable': abi['payable'],
+                        'read_only': read_only
                     }
 
                 logging.log(0, " Compilation gas estimates:")
@@ -263,56 +435,101 @@ class FuzzingChain(MiningChain):
                     chain.fuzzing_data.set_expected_cost(
                         contract_name, fname, desc['evm']['gasEstimates']['external'][function])
 
-        block = chain.get_vm().finalize_block(chain.get_block())
-
-        nonce, mix_hash = mine_pow_nonce(
-            block.number,
-            block.header.mining_hash,
-            block.header.difficulty
-        )
-
-        chain.mine_block(mix_hash=mix_hash, nonce=nonce)
+        if snapshot is None:
+            chain.seal_block()
+        # else: the deployment block was already mined in the snapshot
 
         return chain
 
+    def snapshot(self):
+        '''Captures the current state of the chain, so it can be forked by passing it to FuzzingChain.init.
+        '''
+        return ChainSnapshot(self)
+
     def fuzz(self, log=None):
         '''Mines a block, executing a number of transactions to fuzz the contracts being tested.
         '''
         for _ in range(self.txs):
-            contract_address = choice(list(self.contracts))
+            contract_address = self.rng.choice(list(self.contracts))
             contract_name = self.contract_names[contract_address]
-            function_name = choice(list(self.contracts[contract_address]))
+            function_name = self.rng.choice(list(self.contracts[contract_address]))
 
-            function_hash = self.contracts[contract_address][function_name]['hash']
-            call = self.fuzzer.generate_args(
-                contract_name,
-                function_name,
-                [arg for arg in self.contracts[contract_address][function_name]['in']],
-                value=self.contracts[contract_address][function_name]['payable']
-            )
+            for attempt in range(self.max_retries + 1):
+                call, computation, outcome = self.fuzz_call(contract_address, contract_name, function_name)
+                # Arguments are generated again while the function reverts too often
+                if (outcome != 'revert' or self.retry_threshold is None or attempt == self.max_retries
+                        or self.fuzzing_data.revert_rate(contract_name, function_name) <= self.retry_threshold):
+                    break
+                # Only the last attempt is a sample of the function, discarded ones are counted apart
+                self.fuzzing_data.register_retry(contract_name, function_name, computation.get_gas_used())
 
+            self.log_function_call(
+                contract_name, function_name, call['pk'], call['args'], call['value'], computation.get_gas_used(), outcome)
+
+            if self.profile_opcodes:
+                self.fuzzing_data.register_opcodes(contract_name, function_name, computation.opcode_costs)
+
+            if self.progress:
+                self.progress.update()
+
+        self.seal_block()
+
+    def fuzz_call(self, contract_address, contract_name, function_name):
+        '''Calls a function with new arguments, tracing the call and logging its output.
+        Returns the call, its computation and its outcome, for the caller to register.
+        '''
+        function_hash = self.contracts[contract_address][function_name]['hash']
+        call = self.fuzzer.generate_args(
+            contract_name,
+            function_name,
+            [arg for arg in self.contracts[contract_address][function_name]['in']],
+            value=self.contracts[contract_address][function_name]['payable']
+        )
+
+        if self.contracts[contract_address][function_name]['read_only']:
+            # view and pure functions can't change the state, so they don't need a transaction
+            computation = self.read_only_call(
+                contract_address, b''.join([function_hash, call['data']]), call['pk'], call['value'])
+        else:
             _, _, computation = self.call_function(
                 contract_address, function_hash, call)
 
-            self.log_function_call(
-                contract_name, function_name, call['pk'], call['args'], call['value'], computation.get_gas_used())
-            out_types = [arg['type']
-                         for arg in self.contracts[contract_address][function_name]['out']]
-            try:
-                computation.raise_if_error()
-                logging.log(0,
-                            f" Returned value: {decode_abi(out_types, computation.output)}")
-            except Revert as r:
-                logging.log(0, f" Call reverted. {r.args[0]}")
-            except VMError as e:
-                logging.log(0, f" Call resulted in error: {e}")
-            except Exception as e:
-                logging.log(0,
-                            f" Something went wrong while decoding the output. {e}")
+        outcome = call_outcome(computation)
 
-            if self.progress:
-                with self.progress:
-                    self.progress.update()
+        if self.trace:
+            self.trace.record(
+                self.header.block_number, contract_name, function_name, call['pk'], call['value'],
+                call['data'], computation.get_gas_used(), outcome)
+
+        # Decoding the output is only worth it if it is logged
+        if logging.root.isEnabledFor(CHAIN_DEBUG):
+            self.log_output(
+                [arg['type'] for arg in self.contracts[contract_address][function_name]['out']],
+                computation
+            )
+
+        return call, computation, outcome
+
+    def log_output(self, out_types, computation):
+        try:
+            computation.raise_if_error()
+            logging.log(CHAIN_DEBUG,
+                        f" Returned value: {decode_abi(out_types, computation.output)}")
+        except Revert as r:
+            logging.log(CHAIN_DEBUG, f" Call reverted. {r.args[0]}")
+        except VMError as e:
+            logging.log(CHAIN_DEBUG, f" Call resulted in error: {e}")
+        except Exception as e:
+            logging.log(CHAIN_DEBUG,
+                        f" Something went wrong while decoding the output. {e}")
+
+    def seal_block(self):
+        '''Mines the current block, searching for a proof of work nonce only if the chain is configured to.
+        '''
+        self.state_reads.clear()
+
+        if not self.mine_pow:
+            return self.mine_block()
 
         block = self.get_vm().finalize_block(self.get_block())
 
@@ -322,13 +539,21 @@ class FuzzingChain(MiningChain):
             block.header.difficulty
         )
 
-        self.mine_block(mix_hash=mix_hash, nonce=nonce)
+        return self.mine_block(mix_hash=mix_hash, nonce=nonce)
 
     def get_state_contract(self, contract_name):
+        '''Returns a function that reads the public state variables of a contract.
+        Reads don't change the chain, and are memoized until the next transaction or block.
+        '''
         def get_state_variable(function_name):
-            logging.log(
-                logging.DEBUG, f"Retrieving value for {contract_name}.{function_name}")
+            if (contract_name, function_name) in self.state_reads:
+                return self.state_reads[(contract_name, function_name)]
 
+            if logging.root.isEnabledFor(logging.DEBUG):
+                logging.log(
+                    logging.DEBUG, f"Retrieving value for {contract_name}.{function_name}")
+
+            contract_address = None
             for address, name in self.contract_names.items():
                 if name == contract_name:
                     contract_address = address
@@ -337,17 +562,11 @@ class FuzzingChain(MiningChain):
                 logging.log(
                     logging.CRITICAL, f"Could not find contract with name {contract_name}")
 
-            call = self.fuzzer.generate_args(
-                contract_name,
-                function_name,
-                [arg for arg in self.contracts[contract_address][function_name]['in']],
-                value=self.contracts[contract_address][function_name]['payable']
-            )
-
             function_hash = self.contracts[contract_address][function_name]['hash']
 
-            _, _, computation = self.call_function(
-                contract_address, function_hash, call)
+            # Getters of state variables take no arguments
+            computation = self.read_only_call(
+                contract_address, function_hash, self._faucet['pk'])
 
             out_types = [
                 arg['type'] for arg in self.contracts[contract_address][function_name]['out']
@@ -356,15 +575,17 @@ class FuzzingChain(MiningChain):
             try:
                 computation.raise_if_error()
                 val = decode_abi(out_types, computation.output)[0]
-                logging.log(
-                    logging.DEBUG, f"Retrieved value {val} for {contract_name}.{function_name}")
-                return decode_abi(out_types, computation.output)[0]
+                if logging.root.isEnabledFor(logging.DEBUG):
+                    logging.log(
+                        logging.DEBUG, f"Retrieved value {val} for {contract_name}.{function_name}")
+                self.state_reads[(contract_name, function_name)] = val
+                return val
             except Revert as r:
-                logging.log(0, f" Call reverted. {r.args[0]}")
+                logging.log(CHAIN_DEBUG, f" Call reverted. {r.args[0]}")
             except VMError as e:
-                logging.log(0, f" Call resulted in error: {e}")
+                logging.log(CHAIN_DEBUG, f" Call resulted in error: {e}")
             except Exception as e:
-                logging.log(0,
+                logging.log(CHAIN_DEBUG,
                             f" Something went wrong while decoding the output. {e}")
 
         return get_state_variable
@@ -381,12 +602,49 @@ class FuzzingChain(MiningChain):
             data=b''.join([function_hash, call['data']])
         )
 
-        signed_tx = tx.as_signed_transaction(call['sk'])
+        if self.trusted_transactions:
+            signed_tx = self.as_trusted_transaction(tx, call['pk'])
+        else:
+            signed_tx = tx.as_signed_transaction(call['sk'])
 
         header, receipt, computation = self.apply_transaction(signed_tx)
+        self.state_reads.clear()
 
         return (header, receipt, computation)
 
+    def as_trusted_transaction(self, tx, sender):
+        '''Converts an unsigned transaction into a trusted transaction from sender, skipping all ECDSA operations.
+        '''
+        return trusted_transaction_class(self.get_vm().get_transaction_class())(
+            nonce=tx.nonce,
+            gas_price=tx.gas_price,
+            gas=tx.gas,
+            to=tx.to,
+            value=tx.value,
+            data=tx.data,
+            v=27,
+            r=int.from_bytes(sender, byteorder='big'),
+            s=1
+        )
+
+    def read_only_call(self, to, data, sender, value=0):
+        '''Executes a message call from sender against the current state, without signing or persisting it.
+        Returns the computation, which reports the gas used like the one of a transaction.
+        '''
+        vm = self.get_vm()
+
+        tx = vm.create_unsigned_transaction(
+            nonce=vm.state.account_db.get_nonce(sender),
+            gas_price=0,
+            gas=10000000,
+            to=to,
+            value=value,
+            data=data
+        )
+
+        with vm.state_in_temp_block() as state:
+            return state.costless_execute_transaction(SpoofTransaction(tx, from_=sender))
+
     def transfer_from_faucet(self, pk, value):
         _, _, computation = self.call_function(
             pk,
@@ -400,12 +658,42 @@ class FuzzingChain(MiningChain):
         )
         computation.raise_if_error()
 
-    def log_function_call(self, cname, fname, pk, primitive_args, value, gas_used):
-        logging.log(0,
-                    f''' 
+    def log_function_call(self, cname, fname, pk, primitive_args, value, gas_used, outcome='success'):
+        if logging.root.isEnabledFor(CHAIN_DEBUG):
+            logging.log(CHAIN_DEBUG,
+                        f''' 
             FUNCTION CALL: {cname}: {fname} ({", ".join(f"{_type} {name}: {value}" for name, _type, value in primitive_args)})
                 CALLER: 0x{pk.hex()} 
                 VALUE: {value} 
-                GAS SPENT: {gas_used}''')
+                GAS SPENT: {gas_used}
+                OUTCOME: {outcome}''')
+
+        self.fuzzing_data.register_call(cname, fname, gas_used, outcome)
+
+
+class ChainSnapshot():
+    '''Picklable copy of a deployed FuzzingChain.
+    Holds the chain database and the accounts and contract addresses registered in its fuzzer.
+    '''
+    def __init__(self, chain):
+        self.db = dict(chain.chaindb.db.wrapped_db.kv_store)
+        self.faucet_sk = chain._faucet['sk'].to_bytes()
+
+        # Keys are stored as bytes to keep the snapshot picklable
+        self.accounts = [(sk.to_bytes(), pk) for sk, pk in chain.fuzzer.accounts]
+        self.balances = dict(chain.fuzzer.balances)
+        self.account_pool = list(chain.fuzzer.account_pool.accounts)
+        self.account_pool_balances = dict(chain.fuzzer.account_pool.balances)
+
+        self.addresses = {
+            name: address for address, name in chain.contract_names.items()
+        }
+
+        # Gas spent by the constructors while deploying
+        self.fuzzing_data = chain.fuzzing_data
+
+    def get_accounts(self):
+        return [(keys.PrivateKey(sk), pk) for sk, pk in self.accounts]
 
-        self.fuzzing_data.register_call(cname, fname, gas_used)
+    def get_account_pool(self):
+        return self.account_pool
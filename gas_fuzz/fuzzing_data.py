@@ -1,45 +1,253 @@
 import matplotlib.pyplot as plt
 import os
+import json
+from array import array
+
+from gas_statistics import GasStatistics
+from opcode_profile import OpcodeProfile
+from results_stream import OUTCOMES
 
 class FuzzingData:
-    def __init__(self):
+    def __init__(self, sink=None, keep_costs=True):
+        '''sink is an optional ResultsWriter that receives every registered cost as it arrives.
+        Without keep_costs, actual costs are not held in memory, only summarized in statistics and sent to the sink.
+        '''
         self.expected_costs = {}
+        # Gas costs of each function, as arrays of unsigned 64 bit integers
         self.actual_costs = {}
+        # GasStatistics of each function, kept even without the actual costs
+        self.statistics = {}
+        # GasStatistics of each function, by outcome of its calls
+        self.outcome_statistics = {}
+        # Outcome of every call in actual_costs, as indices of OUTCOMES
+        self.call_outcomes = {}
+        # OpcodeProfile of each function, only registered when profiling opcodes
+        self.opcode_profiles = {}
+        # GasStatistics of the reverted attempts of each function that were discarded and retried
+        self.retry_statistics = {}
+        self.sink = sink
+        self.keep_costs = keep_costs
 
     def merge(self, data):
         # Overwrite because they should be deterministic between the same inputs
-        self.expected_costs = data.expected_costs
+        self.expected_costs = {
+            contract_name: dict(functions) for contract_name, functions in data.expected_costs.items()
+        }
+
+        for contract_name, functions in data.statistics.items():
+            for function_name, statistics in functions.items():
+                self.get_statistics(contract_name, function_name).merge(statistics)
+
+        for contract_name, functions in data.outcome_statistics.items():
+            for function_name, outcomes in functions.items():
+                for outcome, statistics in outcomes.items():
+                    self.get_outcome_statistics(contract_name, function_name, outcome).merge(statistics)
+
+        self.merge_unstreamed(data)
+
+        if self.sink:
+            for contract_name, functions in data.expected_costs.items():
+                for function_name, expected_cost in functions.items():
+                    self.sink.expected_cost(contract_name, function_name, expected_cost)
+            for contract_name, functions in data.actual_costs.items():
+                for function_name, costs in functions.items():
+                    outcomes = data.call_outcomes[contract_name][function_name]
+                    for cost, outcome in zip(costs, outcomes):
+                        self.sink.call(contract_name, function_name, cost, OUTCOMES[outcome])
+
+        if not self.keep_costs:
+            return
 
         for contract_name in data.actual_costs.keys():
             if contract_name not in self.actual_costs:
                 self.actual_costs[contract_name] = {}
             for function_name in data.actual_costs[contract_name].keys():
+                # Copies the buffers directly, without creating an int object per cost
                 if function_name in self.actual_costs[contract_name]:
-                    self.actual_costs[contract_name][function_name] += data.actual_costs[contract_name][function_name]
+                    self.actual_costs[contract_name][function_name].extend(data.actual_costs[contract_name][function_name])
+                    self.call_outcomes[contract_name][function_name].extend(data.call_outcomes[contract_name][function_name])
                 else:
-                    self.actual_costs[contract_name][function_name] = data.actual_costs[contract_name][function_name]
+                    self.actual_costs[contract_name][function_name] = array('Q', data.actual_costs[contract_name][function_name])
+                    self.call_outcomes.setdefault(contract_name, {})[function_name] = array(
+                        'B', data.call_outcomes[contract_name][function_name])
+
+    def merge_unstreamed(self, data):
+        '''Merges the results that aren't sent to sinks: opcode profiles and retried attempts
+        '''
+        for contract_name, functions in data.opcode_profiles.items():
+            for function_name, profile in functions.items():
+                self.get_opcode_profile(contract_name, function_name).merge(profile)
+
+        for contract_name, functions in data.retry_statistics.items():
+            for function_name, statistics in functions.items():
+                self.get_retry_statistics(contract_name, function_name).merge(statistics)
 
     def set_expected_cost(self, contract, fun, expected_cost):
         if contract not in self.expected_costs:
             self.expected_costs[contract] = {}
         self.expected_costs[contract][fun] = expected_cost
 
-    def register_call(self, contract, fun, gas_cost):
+        if self.sink:
+            self.sink.expected_cost(contract, fun, expected_cost)
+
+    def get_statistics(self, contract, fun):
+        if contract not in self.statistics:
+            self.statistics[contract] = {}
+        if fun not in self.statistics[contract]:
+            self.statistics[contract][fun] = GasStatistics()
+        return self.statistics[contract][fun]
+
+    def get_outcome_statistics(self, contract, fun, outcome):
+        outcomes = self.outcome_statistics.setdefault(contract, {}).setdefault(fun, {})
+        if outcome not in outcomes:
+            outcomes[outcome] = GasStatistics()
+        return outcomes[outcome]
+
+    def get_opcode_profile(self, contract, fun):
+        functions = self.opcode_profiles.setdefault(contract, {})
+        if fun not in functions:
+            functions[fun] = OpcodeProfile()
+        return functions[fun]
+
+    def register_opcodes(self, contract, fun, opcode_costs):
+        '''Registers the opcodes run by a call, as (pc, mnemonic, gas) tuples
+        '''
+        self.get_opcode_profile(contract, fun).add(opcode_costs)
+
+    def get_retry_statistics(self, contract, fun):
+        functions = self.retry_statistics.setdefault(contract, {})
+        if fun not in functions:
+            functions[fun] = GasStatistics()
+        return functions[fun]
+
+    def register_retry(self, contract, fun, gas_cost):
+        '''Registers a reverted attempt that was discarded and retried with new arguments.
+        It only counts towards the revert rate and the retry statistics, not as a call of the function.
+        '''
+        self.get_retry_statistics(contract, fun).add(gas_cost)
+
+    def revert_rate(self, contract, fun):
+        '''Fraction of the attempts to call a function that reverted, counting discarded retries
+        '''
+        retries = self.get_retry_statistics(contract, fun).count
+        count = self.get_statistics(contract, fun).count + retries
+        if count == 0:
+            return 0.0
+        return (self.get_outcome_statistics(contract, fun, 'revert').count + retries) / count
+
+    def register_call(self, contract, fun, gas_cost, outcome='success'):
+        '''Registers the gas used by a call, and its outcome, one of OUTCOMES
+        '''
+        self.get_statistics(contract, fun).add(gas_cost)
+        self.get_outcome_statistics(contract, fun, outcome).add(gas_cost)
+
+        if self.sink:
+            self.sink.call(contract, fun, gas_cost, outcome)
+
+        if not self.keep_costs:
+            return
+
         if contract not in self.actual_costs:
             self.actual_costs[contract] = {}
+            self.call_outcomes[contract] = {}
         if fun not in self.actual_costs[contract]:
-            self.actual_costs[contract][fun] = []
+            self.actual_costs[contract][fun] = array('Q')
+            self.call_outcomes[contract][fun] = array('B')
         self.actual_costs[contract][fun].append(gas_cost)
+        self.call_outcomes[contract][fun].append(OUTCOMES.index(outcome))
+
+    def function_costs(self):
+        '''Yields the contract, function, actual costs and call outcomes of every function
+        '''
+        for contract, functions in self.actual_costs.items():
+            for function, costs in functions.items():
+                yield contract, function, costs, self.call_outcomes[contract][function]
+
+    @staticmethod
+    def costs_by_outcome(costs, outcomes):
+        '''Splits the costs of a function by the outcome of their calls
+        '''
+        # Usually every call succeeds, and the costs don't need to be split
+        if outcomes.count(0) == len(outcomes):
+            return {'success': costs}
+
+        split = {outcome: array('Q') for outcome in OUTCOMES}
+        for cost, outcome in zip(costs, outcomes):
+            split[OUTCOMES[outcome]].append(cost)
+        return split
+
+    def export(self, folder="", filename="result", functions=None):
+        '''Writes the costs of the successful calls of every function to a file named after it,
+        and the costs of its failed calls to files with the outcome as extension, as in add.revert.
+        functions yields the costs to export like function_costs does, which it defaults to.
+        '''
+        for contract, function, function_costs, outcomes in functions or self.function_costs():
+            path = f"{folder}/{filename}/{contract}"
+            if not os.path.exists(path):
+                os.makedirs(path)
+            for outcome, costs in self.costs_by_outcome(function_costs, outcomes).items():
+                if outcome != 'success' and not costs:
+                    continue
+                name = function if outcome == 'success' else f"{function}.{outcome}"
+                with open(path + f"/{name}", "w") as file:
+                    file.write(f"{self.expected_costs[contract][function]}\n")
+                    file.writelines(f"{cost}\n" for cost in costs)
+
+    def export_store(self, store, filename="result", functions=None):
+        '''Saves the results to a ResultsStore, under filename.
+        functions yields the costs to save like function_costs does, which it defaults to.
+        '''
+        store.save(filename, self.expected_costs, functions or self.function_costs())
+
+    def outcome_summary(self, contract, fun):
+        '''Statistics of the successful and of the failed calls of a function, its number of calls of each outcome,
+        and the statistics of its discarded retries
+        '''
+        outcomes = self.outcome_statistics.get(contract, {}).get(fun, {})
+        failure = GasStatistics()
+        for outcome in OUTCOMES[1:]:
+            if outcome in outcomes:
+                failure.merge(outcomes[outcome])
+
+        return {
+            'success': outcomes.get('success', GasStatistics()).to_dict(),
+            'failure': failure.to_dict(),
+            'outcomes': {outcome: outcomes[outcome].count if outcome in outcomes else 0 for outcome in OUTCOMES},
+            'retried': self.retry_statistics.get(contract, {}).get(fun, GasStatistics()).to_dict(),
+        }
+
+    def export_statistics(self, folder="", filename="result"):
+        '''Writes the statistics of every function, and its expected cost, to a single JSON file.
+        Besides the statistics of all calls, the successful and the failed calls are summarized separately.
+        '''
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+
+        with open(f"{folder}/{filename}.json", "w") as file:
+            json.dump({
+                contract: {
+                    function: dict(
+                        expected=self.expected_costs.get(contract, {}).get(function),
+                        **statistics.to_dict(),
+                        **self.outcome_summary(contract, function)
+                    ) for function, statistics in functions.items()
+                } for contract, functions in self.statistics.items()
+            }, file, indent=2, sort_keys=True)
+
+    def export_opcode_profiles(self, folder="", filename="result"):
+        '''Writes the opcode profile of every profiled function to a single JSON file.
+        The gas variance of each pc is taken over every call of its function,
+        so a call that never reaches a pc counts as spending zero gas at it.
+        '''
+        if not self.opcode_profiles:
+            return
+
+        if not os.path.exists(folder):
+            os.makedirs(folder)
 
-    def export(self, folder="", filename="result"):
-        for contract in self.actual_costs.keys():
-            for function in self.actual_costs[contract].keys():
-                path = f"{folder}/{filename}/{contract}"
-                if not os.path.exists(path):
-                    os.makedirs(path)
-                with open(path + f"/{function}", "w") as file:
-                    lines = f"{self.expected_costs[contract][function]}\n"
-                    for cost in self.actual_costs[contract][function]:
-                        lines += f"{cost}\n"
-
-                    file.writelines(lines)
+        with open(f"{folder}/{filename}.json", "w") as file:
+            json.dump({
+                contract: {
+                    function: profile.to_dict() for function, profile in functions.items()
+                } for contract, functions in self.opcode_profiles.items()
+            }, file, indent=2, sort_keys=True)
@@ -1,5 +1,3 @@
-from random import randint
-
 class BaseFuzzerRule():
     def __init__(self, rule, fuzzer=None, loc=0, related_args=[], **kwargs):
         self.related_args = related_args
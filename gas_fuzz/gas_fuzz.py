@@ -4,10 +4,12 @@ import argparse
 import os
 from os.path import abspath
 import subprocess
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
 import sys
 import tempfile
 import io
+import hashlib
+from random import Random
 
 from glob import glob
 
@@ -15,10 +17,14 @@ from json import dumps, loads
 
 from functools import reduce
 
+from account_pool import MAX_ACCOUNTS
+from compilation_cache import CompilationCache
 from fuzzing_chain import FuzzingChain
 from fuzzing_data import FuzzingData
-from progress import ProgressBar
-from eth import constants
+from results_stream import ResultsWriter, split_streams, load_split
+from results_store import ResultsStore
+from trace_writer import TraceWriter
+from progress import ProgressBar, SharedCounter
 from eth.vm import forks
 
 from solc import install_solc
@@ -28,6 +34,8 @@ from pprint import pprint
 import logging
 import colorlog
 
+SOLC_VERSION = 'v0.4.25'
+
 
 def main():
     # Receives a list of source files to fuzz.
@@ -56,6 +64,44 @@ def main():
     parser.add_argument("-l", "--log", type=int, default=2,
                         help="Log level to be used. From 0 to 5, CHAIN DEBUG (0), DEBUG (1), INFO (2, default), WARNING (3), ERROR (4), CRITICAL (5)")
     parser.add_argument("-d", "--debug", action='store_true', help="print stack traces")
+    parser.add_argument("-w", "--workers", metavar="N", type=int, default=None,
+                        help="number of simulations to run concurrently (defaults to the number of processors)")
+    parser.add_argument("-e", "--executor", choices=["thread", "process"], default="thread",
+                        help="run simulations in threads (default) or in separate processes")
+    parser.add_argument("--redeploy", action='store_true',
+                        help="deploy the contracts again in every simulation, with new constructor arguments, instead of forking a single deployment")
+    parser.add_argument("--pow", action='store_true',
+                        help="seal every block with a proof of work, which is much slower and doesn't affect gas costs")
+    parser.add_argument("--accounts", metavar="N", type=int, default=MAX_ACCOUNTS,
+                        help="maximum number of accounts sending transactions in each simulation, derived before fuzzing (default %(default)s)")
+    parser.add_argument("--genesis-accounts", action='store_true',
+                        help="fund every account in the genesis state, instead of with a faucet transaction when it is first used")
+    parser.add_argument("--trusted-tx", action='store_true',
+                        help="send transactions without signing them or recovering their senders, which doesn't affect gas costs")
+    parser.add_argument("--cache-dir", default=os.path.join(os.environ["HOME"], ".gas-fuzz/cache"),
+                        help="folder where compiler outputs are cached between runs")
+    parser.add_argument("--cache-size", metavar="MB", type=int, default=256,
+                        help="maximum size of the compilation cache, in megabytes")
+    parser.add_argument("--no-cache", action='store_true',
+                        help="always run the compiler, without reading or writing the compilation cache")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="master seed for reproducible runs. Each simulation gets its own random stream derived from it")
+    parser.add_argument("--stream", metavar="FOLDER",
+                        help="write the gas costs of each simulation to FOLDER while fuzzing, instead of holding them in memory until the end")
+    parser.add_argument("--trace", metavar="FOLDER",
+                        help="write a JSON line for every fuzzed call to FOLDER, with its caller, value, arguments, gas and outcome")
+    parser.add_argument("--retry-reverts", metavar="RATE", type=float, default=None,
+                        help="retry reverted calls with new arguments while more than RATE (0 to 1) of the calls of their function revert")
+    parser.add_argument("--max-retries", type=int, default=5,
+                        help="maximum number of retries of a reverted call with --retry-reverts")
+    parser.add_argument("--profile-opcodes", action='store_true',
+                        help="register the gas used by every opcode of each function, by opcode and by program counter, in profiles/<file>.json")
+    parser.add_argument("--summary-only", action='store_true',
+                        help="only keep and export the statistics of each function, without the gas cost of every call")
+    parser.add_argument("--store", action='store_true',
+                        help="save results to a single SQLite database instead of a text file per function")
+    parser.add_argument("--store-path", metavar="DATABASE", default="results.db",
+                        help="path of the database used by --store (default %(default)s)")
 
     args = parser.parse_args()
 
@@ -63,52 +109,260 @@ def main():
     if args.batch:
         files = glob(f"{args.file}/*.sol")
 
-    for file in files:
-        compiled = process_and_compile(file, args.fork)
-
-        total_functions = count_functions(compiled['contracts'])
-        progress = ProgressBar(total_ops=args.simulations * total_functions *
-                               args.block_tx, preamble=f"Fuzzing {getFileName(file)}.sol")
-
-        def simulation_runner():
-            chain_class = FuzzingChain.configure(
-                __name__='Fuzzing Chain',
-                vm_configuration=(
-                    (constants.GENESIS_BLOCK_NUMBER,
-                     args.fork if args.fork else forks.ByzantiumVM),
-                )
+    configure_logging(args.log)
+
+    cache = None
+    if not args.no_cache:
+        cache = CompilationCache(args.cache_dir, max_size=args.cache_size * 2 ** 20)
+
+    # Compile every file up front, sharing the compiler invocations between them
+    compiled_files = process_and_compile_batch(files, args.fork, cache)
+
+    contexts = {
+        file: {
+            'compiled': compiled_files[file],
+            'fork': args.fork,
+            'block_tx': args.block_tx,
+            'rules': args.rules,
+            'total_functions': count_functions(compiled_files[file]['contracts']),
+            'mine_pow': args.pow,
+            'trusted_transactions': args.trusted_tx,
+            'profile_opcodes': args.profile_opcodes,
+            'max_accounts': args.accounts,
+            'genesis_accounts': args.genesis_accounts,
+            'trace': args.trace,
+            'retry_threshold': args.retry_reverts,
+            'max_retries': args.max_retries,
+            'seed': args.seed,
+            'stream': args.stream,
+            'keep_costs': not args.summary_only,
+        } for file in files
+    }
+
+    for folder in (args.stream, args.trace):
+        if folder:
+            for file in files:
+                os.makedirs(os.path.join(folder, getFileName(file)), exist_ok=True)
+
+    # Transactions executed by each simulation of a file
+    simulation_ops = {
+        file: context['total_functions'] * args.block_tx for file, context in contexts.items()
+    }
+
+    workers = args.workers if args.workers else os.cpu_count()
+
+    progress = ProgressBar(
+        total_ops=args.simulations * sum(simulation_ops.values()),
+        preamble=f"Fuzzing {getFileName(files[0])}.sol" if len(files) == 1 else f"Fuzzing {len(files)} files",
+        processes=workers if args.executor == "process" else 0
+    )
+
+    if args.executor == "process":
+        # The compiled outputs are shipped once to each worker, instead of once per simulation
+        executor = ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=init_worker,
+            initargs=(args.log, contexts, progress.shared_counts, progress.next_slot)
+        )
+        deploy = lambda file: executor.submit(worker_deploy_snapshot, file)
+        submit = lambda file, sim_id, snapshot: executor.submit(worker_simulation_runner, file, sim_id, snapshot)
+    else:
+        executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="Simulation")
+        deploy = lambda file: executor.submit(deploy_snapshot, file, **contexts[file])
+        submit = lambda file, sim_id, snapshot: executor.submit(
+            simulation_runner, file, sim_id, snapshot=snapshot, progress=progress, **contexts[file])
+
+    # Every deployment and every (file, simulation) pair is a unit of work in the same pool.
+    # The simulations of a file are submitted once its deployment is done, and results are saved as soon as a file is done
+    # Results are merged in simulation order, so seeded runs export identical files
+    simulation_data = {file: {} for file in files}
+    pending = {file: args.simulations for file in files}
+    # Constructor costs of each file, registered once by the deployment its simulations fork from
+    deployment_data = {file: FuzzingData() for file in files}
+
+    store = ResultsStore(args.store_path) if args.store and not args.summary_only else None
+
+    try:
+        with executor:
+            if args.redeploy:
+                # Every simulation deploys the contracts again
+                future_to_id = {
+                    submit(file, i, None): (file, i) for file in files for i in range(args.simulations)
+                }
+            else:
+                future_to_id = {deploy(file): (file, None) for file in files}
+
+            while future_to_id:
+                done, _ = wait(future_to_id, return_when=FIRST_COMPLETED)
+                for future in done:
+                    file, sim_id = future_to_id.pop(future)
+
+                    if sim_id is None:
+                        try:
+                            snapshot = future.result()
+                        except Exception as exc:
+                            logging.critical(
+                                f'Deployment of {file} generated an exception:\n{type(exc).__name__}:\n\t{exc}')
+
+                            if (args.debug):
+                                raise exc
+                            continue
+
+                        # The snapshot is only referenced by the simulations of the file, and dropped when they are done
+                        deployment_data[file], snapshot.fuzzing_data = snapshot.fuzzing_data, None
+                        future_to_id.update({
+                            submit(file, i, snapshot): (file, i) for i in range(args.simulations)
+                        })
+                        continue
+
+                    try:
+                        simulation_data[file][sim_id] = future.result()
+                    except Exception as exc:
+                        logging.critical(
+                            f'Simulation {sim_id} of {file} generated an exception:\n{type(exc).__name__}:\n\t{exc}')
+
+                        if (args.debug):
+                            raise exc
+
+                    pending[file] -= 1
+                    if pending[file] == 0:
+                        save_results(file, args, store, deployment_data.pop(file), simulation_data.pop(file))
+
+        progress.close()
+    finally:
+        if store:
+            store.close()
+
+    sys.stdout.write("\033[K")
+
+
+def save_results(file, args, store, deployment_data, simulation_data):
+    '''Merges the results of every simulation of a file, after its deployment costs, and exports them.
+    Streamed costs are exported from the streams a function at a time, without loading every call.
+    '''
+    streamed = args.stream and not args.summary_only
+
+    # Simulations that stream their costs only return their statistics
+    total_data = FuzzingData(keep_costs=not streamed)
+    total_data.merge(deployment_data)
+    for _, data in sorted(simulation_data.items()):
+        total_data.merge(data)
+
+    if streamed:
+        with tempfile.TemporaryDirectory() as folder:
+            # The deployment costs are streamed first, like they are merged otherwise
+            deployment_stream = os.path.join(folder, "deployment.gfr")
+            with ResultsWriter(deployment_stream) as sink:
+                FuzzingData(sink=sink, keep_costs=False).merge(deployment_data)
+
+            split = split_streams(
+                [deployment_stream] + [stream_path(args.stream, file, i) for i in sorted(simulation_data)],
+                folder
             )
-            colorlog.basicConfig(level=args.log * 10, format='%(log_color)s[%(levelname)-8s %(threadName)10s]%(reset)s %(message)s')
-            logging.addLevelName(0, "CHAIN DEBUG")
+            functions = (
+                (contract, function) + load_split(split[(contract, function)])
+                for contract, function in sorted(split)
+            )
+            export_costs(total_data, file, store, functions)
+    elif not args.summary_only:
+        export_costs(total_data, file, store)
+
+    total_data.export_statistics(folder="statistics", filename=f"{getFileName(file)}")
+    total_data.export_opcode_profiles(folder="profiles", filename=f"{getFileName(file)}")
+    logging.info(f"Saved results of {getFileName(file)}.sol")
+
+
+def export_costs(total_data, file, store=None, functions=None):
+    if store:
+        total_data.export_store(store, filename=f"{getFileName(file)}", functions=functions)
+    else:
+        total_data.export(folder="results", filename=f"{getFileName(file)}", functions=functions)
+
+
+def configure_logging(level):
+    colorlog.basicConfig(level=level * 10, format='%(log_color)s[%(levelname)-8s %(processName)s %(threadName)10s]%(reset)s %(message)s')
+    logging.addLevelName(0, "CHAIN DEBUG")
+
+
+def chain_class_for(fork, mine_pow=False, trusted_transactions=False, profile_opcodes=False):
+    return FuzzingChain.configure_fork(
+        fork if fork else forks.ByzantiumVM, mine_pow=mine_pow, trusted_transactions=trusted_transactions,
+        profile_opcodes=profile_opcodes)
+
+
+def derive_rng(seed, file, stream):
+    '''Returns an independent random stream for a part of the run, or an unseeded one if there is no master seed.
+    Streams depend on the file name rather than its path, so the same workload reproduces from anywhere.
+    '''
+    if seed is None:
+        return Random()
+
+    digest = hashlib.sha256(f"{seed}:{getFileName(file)}:{stream}".encode('utf-8')).digest()
+    return Random(int.from_bytes(digest[:8], byteorder='big'))
+
+
+def deploy_snapshot(file, compiled, fork, block_tx, rules, mine_pow=False, seed=None, trusted_transactions=False, max_accounts=MAX_ACCOUNTS, genesis_accounts=False, profile_opcodes=False, **simulation_args):
+    '''Deploys the contracts of file once, returning the ChainSnapshot every simulation of the file forks from.
+    Takes the same arguments as simulation_runner, ignoring the ones only simulations use.
+    '''
+    chain = chain_class_for(fork, mine_pow, trusted_transactions, profile_opcodes).init(
+        compiled['contracts'], ast=compiled['sources'], tx=block_tx, rules=rules, rng=derive_rng(seed, file, "deployment"),
+        max_accounts=max_accounts, genesis_accounts=genesis_accounts)
+
+    return chain.snapshot()
+
+
+def stream_path(folder, file, sim_id, extension="gfr"):
+    return os.path.join(folder, getFileName(file), f"simulation-{sim_id}.{extension}")
+
 
-            chain = chain_class.init(
-                compiled['contracts'], ast=compiled['sources'], tx=args.block_tx, rules=args.rules, progress=progress)
+def simulation_runner(file, sim_id, compiled, fork, block_tx, rules, total_functions, snapshot=None, progress=None, mine_pow=False, seed=None, stream=None, keep_costs=True, trusted_transactions=False, max_accounts=MAX_ACCOUNTS, genesis_accounts=False, trace=None, retry_threshold=None, max_retries=5, profile_opcodes=False):
+    sink = ResultsWriter(stream_path(stream, file, sim_id)) if stream else None
+    fuzzing_data = FuzzingData(sink=sink, keep_costs=keep_costs and sink is None)
+    trace_writer = TraceWriter(stream_path(trace, file, sim_id, "jsonl"), simulation=sim_id) if trace else None
 
-            for _ in range(total_functions):
-                chain.fuzz()
+    try:
+        # Without a snapshot, the simulation deploys the contracts itself
+        chain = chain_class_for(fork, mine_pow, trusted_transactions, profile_opcodes).init(
+            compiled['contracts'], ast=compiled['sources'], tx=block_tx, rules=rules, progress=progress, snapshot=snapshot,
+            rng=derive_rng(seed, file, sim_id), fuzzing_data=fuzzing_data, max_accounts=max_accounts,
+            genesis_accounts=genesis_accounts, trace=trace_writer, retry_threshold=retry_threshold,
+            max_retries=max_retries)
 
-            return chain.fuzzing_data
+        for _ in range(total_functions):
+            chain.fuzz()
+    finally:
+        if sink:
+            sink.close()
+        if trace_writer:
+            trace_writer.close()
 
-        total_data = FuzzingData()
+    # The sink's file can't be sent back from a worker process
+    fuzzing_data.sink = None
 
-        with ThreadPoolExecutor(thread_name_prefix="Simulation") as executor:
-            future_to_id = {executor.submit(
-                simulation_runner): i for i in range(args.simulations)}
+    return fuzzing_data
 
-            for future in as_completed(future_to_id):
-                sim_id = future_to_id[future]
-                try:
-                    total_data.merge(future.result())
-                except Exception as exc:
-                    logging.critical(
-                        f'Simulation {sim_id} generated an exception:\n{type(exc).__name__}:\n\t{exc}')
 
-                    if (args.debug):
-                        raise exc
+# Simulation arguments of each file in the current worker process, and its progress counter, set by init_worker
+_worker_contexts = {}
+_worker_progress = None
 
-        sys.stdout.write("\033[K")
-        print("Saving results...", end="\r")
-        total_data.export(folder="results", filename=f"{getFileName(file)}")
+
+def init_worker(log, contexts, progress_counts, progress_slot):
+    global _worker_progress
+
+    configure_logging(log)
+    _worker_contexts.update(contexts)
+    _worker_progress = SharedCounter.claim(progress_counts, progress_slot)
+
+
+def worker_deploy_snapshot(file):
+    return deploy_snapshot(file, **_worker_contexts[file])
+
+
+def worker_simulation_runner(file, sim_id, snapshot):
+    return simulation_runner(file, sim_id, snapshot=snapshot, progress=_worker_progress, **_worker_contexts[file])
 
 
 def getEvmVersion(fork):
@@ -123,9 +377,36 @@ def getEvmVersion(fork):
         return "constantinople"
     return "byzantium"
 
-def process_and_compile(file, fork):
-    precompiled = compile(file, fork)
+def process_and_compile(file, fork, cache=None):
+    return process_and_compile_batch([file], fork, cache)[file]
+
+
+def process_and_compile_batch(files, fork, cache=None):
+    '''Compiles all files, with their private state variables made public.
+    Returns a dictionary with the compiler output of each file.
+    '''
+    precompiled = compile_batch(files, fork, cache)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        temp_files = {}
+        for i, file in enumerate(files):
+            # Keep the original file name, so the output (and its cache entry) doesn't depend on a random name
+            folder = os.path.join(temp_dir, str(i))
+            os.makedirs(folder)
+            temp_files[file] = os.path.join(folder, file.split('/')[-1])
+
+            make_public(file, precompiled[file], temp_files[file])
+
+        compiled = compile_batch(list(temp_files.values()), fork, cache)
+
+    return {
+        file: compiled[temp_file] for file, temp_file in temp_files.items()
+    }
+
 
+def make_public(file, precompiled, destination):
+    '''Writes file to destination, with every private state variable declared public
+    '''
     # Travel the AST to find all 'VariableDeclaration' nodes
 
     def reduce_ast(acc, node):
@@ -157,7 +438,7 @@ def process_and_compile(file, fork):
 
     private_vars = reduce(reduce_ast, (precompiled['sources'][filename]['ast']['nodes']), [])
 
-    with tempfile.NamedTemporaryFile() as temp_file:
+    with open(destination, 'w+b') as temp_file:
         with io.open(file, 'r', newline='') as original_file:
             temp_file.write(original_file.read().encode('utf-8'))
 
@@ -183,32 +464,98 @@ def process_and_compile(file, fork):
 
             offset_diff -= 2
 
-        temp_file.seek(0)
 
-        return compile(temp_file.name, fork)
+def compile(file, fork, cache=None):
+    return compile_batch([file], fork, cache)[file]
 
 
-def compile(file, fork):
+def compile_batch(files, fork, cache=None):
+    '''Compiles all files, running solc as few times as possible.
+    Returns a dictionary with the compiler output of each file.
+    '''
+    evmVersion = getEvmVersion(fork)
+
+    outputs = {}
+    keys = {}
+
+    for file in files:
+        if cache:
+            with open(file, 'rb') as source:
+                keys[file] = CompilationCache.key(
+                    file.split('/')[-1], source.read(), SOLC_VERSION, evmVersion)
+
+            # The entry of the source lists the files it imports, whose contents are part of the key of the output
+            index = cache.get(keys[file])
+            if index is not None:
+                output_key = imports_key(keys[file], index['imports'])
+                output = cache.get(output_key) if output_key else None
+                if output is not None:
+                    outputs[file] = output
+
+    # Sources are identified by file name, so files sharing a name need separate invocations
+    batches = []
+    for file in files:
+        if file in outputs:
+            continue
+
+        name = file.split('/')[-1]
+        for batch in batches:
+            if name not in batch:
+                batch[name] = file
+                break
+        else:
+            batches.append({name: file})
+
+    for batch in batches:
+        output = run_solc(batch, evmVersion)
+
+        for name, file in batch.items():
+            outputs[file] = split_output(output, name)
+
+            if cache:
+                imports = [source for source in outputs[file]['sources'] if source != name]
+                output_key = imports_key(keys[file], imports)
+                if output_key:
+                    cache.put(keys[file], {'imports': imports})
+                    cache.put(output_key, outputs[file])
+
+    return outputs
+
+
+def imports_key(source_key, imports):
+    '''Extends the cache key of a source with the contents of every file in its import closure,
+    read like solc does, relative to the working directory. Returns None if an import can't be read.
+    '''
+    parts = [source_key]
+    for path in sorted(imports):
+        try:
+            with open(path, 'rb') as imported:
+                parts += [path, imported.read()]
+        except OSError:
+            return None
+    return CompilationCache.key(*parts)
+
+
+def run_solc(files, evmVersion):
+    '''Compiles a dictionary of source names to files in a single solc invocation
+    '''
     solc_path = os.path.join(
-        os.environ["HOME"], ".py-solc/solc-v0.4.25/bin/solc")
+        os.environ["HOME"], f".py-solc/solc-{SOLC_VERSION}/bin/solc")
 
     if not os.path.isfile(solc_path):
-        install_solc('v0.4.25')
+        install_solc(SOLC_VERSION)
 
     sources = {}
     allow_paths = []
 
-    name = file.split('/')[-1]
-
-    allowed_path = "/".join(abspath(file).split("/")[:-1])
-    if allowed_path not in allow_paths:
-        allow_paths.append("/".join(abspath(file).split("/")[:-1]))
-
-    sources[name] = {
-        'urls': [file]
-    }
+    for name, file in files.items():
+        allowed_path = "/".join(abspath(file).split("/")[:-1])
+        if allowed_path not in allow_paths:
+            allow_paths.append(allowed_path)
 
-    evmVersion = getEvmVersion(fork)
+        sources[name] = {
+            'urls': [file]
+        }
 
     result = subprocess.run([
         solc_path,
@@ -247,13 +594,49 @@ def compile(file, fork):
 
     if 'errors' in output:
         if any(error['type'] != "Warning" for error in output['errors']):
-            print(f"Errores al compilar {file}")
+            print(f"Errores al compilar {', '.join(files.values())}")
             raise RuntimeError(output['errors'])
         # else: code compiled with errors
 
     return output
 
 
+def split_output(output, name):
+    '''Extracts the output of a single source, and the sources it imports, from the output of a multi-source compilation
+    '''
+    names = {name}
+    pending = [name]
+    while pending:
+        source = output['sources'].get(pending.pop())
+        if source is None:
+            continue
+
+        for node in source['ast']['nodes']:
+            if node['nodeType'] == 'ImportDirective' and node['absolutePath'] not in names:
+                names.add(node['absolutePath'])
+                pending.append(node['absolutePath'])
+
+    split = {
+        'contracts': {
+            filename: contracts for filename, contracts in output.get('contracts', {}).items()
+            if filename in names
+        },
+        'sources': {
+            filename: source for filename, source in output['sources'].items()
+            if filename in names
+        },
+    }
+
+    errors = [
+        error for error in output.get('errors', [])
+        if error.get('sourceLocation', {}).get('file') in names
+    ]
+    if errors:
+        split['errors'] = errors
+
+    return split
+
+
 def count_functions(contracts):
     counter = 0
     for _filename, file_contracts in contracts.items():
@@ -0,0 +1,78 @@
+from math import ceil, sqrt
+
+
+class GasStatistics():
+    '''Summary of the gas costs of a function, updated as calls are registered.
+    Count, mean and variance are computed online, and the histogram of distinct costs is exact,
+    so quantiles are exact too. Memory grows with the number of distinct costs, not with the number of calls.
+    Statistics of separate simulations can be merged.
+    '''
+    QUANTILES = (0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99)
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        # Sum of squared differences from the mean
+        self.m2 = 0.0
+        self.min = None
+        self.max = None
+        self.histogram = {}
+
+    def add(self, gas_cost):
+        # Welford's online algorithm
+        self.count += 1
+        delta = gas_cost - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (gas_cost - self.mean)
+
+        self.min = gas_cost if self.min is None else min(self.min, gas_cost)
+        self.max = gas_cost if self.max is None else max(self.max, gas_cost)
+
+        self.histogram[gas_cost] = self.histogram.get(gas_cost, 0) + 1
+
+    def merge(self, other):
+        if other.count == 0:
+            return
+
+        # Chan et al. parallel variance
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta ** 2 * self.count * other.count / count
+        self.count = count
+
+        self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = other.max if self.max is None else max(self.max, other.max)
+
+        for gas_cost, frequency in other.histogram.items():
+            self.histogram[gas_cost] = self.histogram.get(gas_cost, 0) + frequency
+
+    def variance(self):
+        return self.m2 / self.count if self.count else 0.0
+
+    def stdev(self):
+        return sqrt(self.variance())
+
+    def quantile(self, q):
+        '''Smallest registered cost with at least a q fraction of the calls at or below it
+        '''
+        if self.count == 0:
+            return None
+
+        rank = max(1, ceil(q * self.count))
+        seen = 0
+        for gas_cost in sorted(self.histogram):
+            seen += self.histogram[gas_cost]
+            if seen >= rank:
+                return gas_cost
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'mean': self.mean,
+            'variance': self.variance(),
+            'min': self.min,
+            'max': self.max,
+            'quantiles': {str(q): self.quantile(q) for q in self.QUANTILES},
+            'histogram': {str(gas_cost): self.histogram[gas_cost] for gas_cost in sorted(self.histogram)},
+        }
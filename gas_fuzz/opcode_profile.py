@@ -0,0 +1,72 @@
+class OpcodeProfile():
+    '''Executions and gas used of every opcode run by the calls of a function,
+    in total by opcode and at each program counter of the called code.
+    The gas of a call or create opcode includes the gas used by the code it runs.
+    Per program counter, the variance of the gas used per call shows which sites make the cost of the function vary.
+    Profiles of separate simulations can be merged.
+    '''
+    def __init__(self):
+        self.calls = 0
+        # [executions, gas] of each opcode, by mnemonic
+        self.opcodes = {}
+        # [mnemonic, executions, gas, sum of the squared gas of each call] of each program counter
+        self.pcs = {}
+
+    def add(self, opcode_costs):
+        '''Registers the opcodes run by a call, as (pc, mnemonic, gas) tuples
+        '''
+        self.calls += 1
+
+        call_pcs = {}
+        for pc, mnemonic, gas in opcode_costs:
+            if mnemonic not in self.opcodes:
+                self.opcodes[mnemonic] = [0, 0]
+            totals = self.opcodes[mnemonic]
+            totals[0] += 1
+            totals[1] += gas
+
+            if pc not in call_pcs:
+                call_pcs[pc] = [mnemonic, 0, 0]
+            totals = call_pcs[pc]
+            totals[1] += 1
+            totals[2] += gas
+
+        for pc, (mnemonic, executions, gas) in call_pcs.items():
+            if pc not in self.pcs:
+                self.pcs[pc] = [mnemonic, 0, 0, 0]
+            totals = self.pcs[pc]
+            totals[1] += executions
+            totals[2] += gas
+            totals[3] += gas ** 2
+
+    def merge(self, other):
+        self.calls += other.calls
+
+        for mnemonic, (executions, gas) in other.opcodes.items():
+            totals = self.opcodes.setdefault(mnemonic, [0, 0])
+            totals[0] += executions
+            totals[1] += gas
+
+        for pc, (mnemonic, executions, gas, squared) in other.pcs.items():
+            totals = self.pcs.setdefault(pc, [mnemonic, 0, 0, 0])
+            totals[1] += executions
+            totals[2] += gas
+            totals[3] += squared
+
+    def to_dict(self):
+        return {
+            'calls': self.calls,
+            'opcodes': {
+                mnemonic: {'executions': executions, 'gas': gas}
+                for mnemonic, (executions, gas) in self.opcodes.items()
+            },
+            'pcs': [
+                {
+                    'pc': pc,
+                    'opcode': mnemonic,
+                    'executions': executions,
+                    'gas': gas,
+                    'variance': squared / self.calls - (gas / self.calls) ** 2,
+                } for pc, (mnemonic, executions, gas, squared) in sorted(self.pcs.items())
+            ],
+        }
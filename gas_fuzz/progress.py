@@ -1,23 +1,100 @@
-from threading import Lock
+from datetime import timedelta
+from multiprocessing import Array, Value
+from threading import Event, Thread, local
+import time
+
+
+class Counter():
+    '''Operations done by a single thread. Only that thread writes to it, so it needs no lock.
+    '''
+    def __init__(self):
+        self.count = 0
+
+    def update(self, ops=1):
+        self.count += ops
+
+
+class SharedCounter():
+    '''Operations done by a single worker process, counted in its own slot of an array shared with the ProgressBar.
+    '''
+    def __init__(self, counts, slot):
+        self.counts = counts
+        self.slot = slot
+
+    @classmethod
+    def claim(cls, counts, next_slot):
+        '''Returns the counter of the first free slot, called once by each worker process
+        '''
+        with next_slot.get_lock():
+            slot = next_slot.value
+            next_slot.value += 1
+        return cls(counts, slot)
+
+    def update(self, ops=1):
+        self.counts[self.slot] += ops
+
 
 class ProgressBar():
-    def __init__(self, total_ops, preamble=None):
-        self.current_ops = 0
+    '''Progress of the operations of a run, rendered every interval seconds by a background thread.
+    Threads count their operations through counter(), and up to processes worker processes through
+    SharedCounter.claim(progress.shared_counts, progress.next_slot), so updates never contend for a lock.
+    '''
+    def __init__(self, total_ops, preamble=None, interval=0.5, processes=0):
         self.total_ops = total_ops
         self.preamble = preamble
-        self.lock = Lock()
+        self.interval = interval
+
+        self.counters = []
+        self.local = local()
+
+        self.shared_counts = Array('Q', processes, lock=False) if processes else None
+        self.next_slot = Value('i', 0) if processes else None
+
+        self.start_time = time.monotonic()
+        self.done = Event()
+        self.thread = Thread(target=self.run, name="Progress", daemon=True)
         self.render()
+        self.thread.start()
+
+    def counter(self):
+        '''Returns the counter of the calling thread
+        '''
+        counter = getattr(self.local, 'counter', None)
+        if counter is None:
+            counter = self.local.counter = Counter()
+            # Appending is atomic, and counters are never removed
+            self.counters.append(counter)
+        return counter
 
-    def __enter__(self):
-        self.lock.acquire()
-        return self
+    def update(self, ops=1):
+        self.counter().update(ops)
 
-    def __exit__(self, type, value, traceback):
-        self.lock.release()
+    @property
+    def current_ops(self):
+        ops = sum(counter.count for counter in self.counters)
+        if self.shared_counts is not None:
+            ops += sum(self.shared_counts)
+        return ops
 
     def render(self):
-        print(f"{self.preamble if self.preamble else ''} {self.current_ops * 100 / self.total_ops:.2f}%", end="\r", flush=True)
+        ops = self.current_ops
+        elapsed = time.monotonic() - self.start_time
+        rate = ops / elapsed if elapsed > 0 else 0
+
+        status = f"{ops * 100 / self.total_ops:.2f}%" if self.total_ops else ""
+        if rate > 0:
+            eta = timedelta(seconds=round(max(self.total_ops - ops, 0) / rate))
+            status += f" {rate:.1f} tx/s ETA {eta}"
+
+        print(f"{self.preamble if self.preamble else ''} {status}\033[K", end="\r", flush=True)
+
+    def run(self):
+        while not self.done.wait(self.interval):
+            self.render()
 
-    def update(self):
-        self.current_ops += 1
+    def close(self):
+        '''Stops rendering, after rendering the final progress
+        '''
+        self.done.set()
+        self.thread.join()
         self.render()
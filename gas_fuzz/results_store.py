@@ -0,0 +1,89 @@
+import sqlite3
+import sys
+import time
+from array import array
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS results (
+    file TEXT NOT NULL,
+    contract TEXT NOT NULL,
+    function TEXT NOT NULL,
+    expected TEXT,
+    -- Gas cost of every call, as little endian unsigned 64 bit integers
+    costs BLOB NOT NULL,
+    -- Outcome of every call, as one byte indices of results_stream.OUTCOMES
+    outcomes BLOB NOT NULL,
+    -- Seconds since the epoch when the row was written
+    updated REAL NOT NULL,
+    PRIMARY KEY (file, contract, function)
+)
+'''
+
+
+def encode_costs(costs):
+    costs = array('Q', costs)
+    if sys.byteorder == 'big':
+        costs.byteswap()
+    return costs.tobytes()
+
+
+def decode_costs(blob):
+    costs = array('Q')
+    costs.frombytes(blob)
+    if sys.byteorder == 'big':
+        costs.byteswap()
+    return costs
+
+
+class ResultsStore():
+    '''Results of every fuzzed file in a single SQLite database, indexed by file, contract and function.
+    Saving a file replaces its previous results.
+    '''
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(SCHEMA)
+        self.connection.commit()
+
+    def save(self, file, expected_costs, functions):
+        '''Saves the costs of every function of a file, and the outcomes of their calls.
+        expected_costs is a {contract: {function: value}} dict,
+        and functions yields (contract, function, costs, outcomes) tuples, which are only consumed as they are saved.
+        '''
+        updated = time.time()
+        with self.connection:
+            self.connection.execute("DELETE FROM results WHERE file = ?", (file,))
+            self.connection.executemany(
+                "INSERT INTO results VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    (file, contract, function, str(expected_costs[contract][function]), encode_costs(costs),
+                     bytes(outcomes), updated)
+                    for contract, function, costs, outcomes in functions
+                )
+            )
+
+    def functions(self):
+        '''Yields (file, contract, function, expected cost, raw costs blob, raw outcomes blob, update time)
+        for every stored function
+        '''
+        yield from self.connection.execute(
+            "SELECT file, contract, function, expected, costs, outcomes, updated FROM results ORDER BY file, contract, function")
+
+    def load(self, file, contract, function):
+        '''Returns the expected cost, gas costs and call outcomes of a function, or None if it isn't stored
+        '''
+        row = self.connection.execute(
+            "SELECT expected, costs, outcomes FROM results WHERE file = ? AND contract = ? AND function = ?",
+            (file, contract, function)
+        ).fetchone()
+        if row is None:
+            return None
+        return row[0], decode_costs(row[1]), array('B', row[2])
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
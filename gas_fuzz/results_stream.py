@@ -0,0 +1,200 @@
+import os
+import struct
+import time
+from array import array
+
+# Stream layout: the MAGIC header, followed by records that start with one of the tags below
+MAGIC = b'GFR1'
+
+# Name of a contract or function: id (H), length (H), utf-8 bytes
+NAME = b'N'
+# Expected cost of a function: contract id (H), function id (H), length (H), utf-8 bytes
+EXPECTED = b'E'
+# Gas used by a call: contract id (H), function id (H), gas (Q)
+CALL = b'C'
+# Gas used by a reverted call, and by a call that failed with any other error, laid out like CALL
+REVERT = b'R'
+ERROR = b'X'
+
+# Outcomes of a call, as classified by fuzzing_chain.call_outcome
+OUTCOMES = ('success', 'revert', 'error')
+# Tag of the calls of each outcome
+OUTCOME_TAGS = {'success': CALL, 'revert': REVERT, 'error': ERROR}
+# Index in OUTCOMES of the calls of each tag
+TAG_OUTCOMES = {tag: OUTCOMES.index(outcome) for outcome, tag in OUTCOME_TAGS.items()}
+
+_name_header = struct.Struct('<HH')
+_expected_header = struct.Struct('<HHH')
+_call = struct.Struct('<HHQ')
+
+
+class ResultsWriter():
+    '''Append-only binary log of the calls registered by a simulation.
+    Records are buffered, and written out every flush_interval seconds or buffer_size bytes,
+    so a crashed run keeps everything but its last moments.
+    '''
+    def __init__(self, path, flush_interval=1.0, buffer_size=2 ** 16):
+        self.file = open(path, 'wb')
+        self.flush_interval = flush_interval
+        self.buffer_size = buffer_size
+
+        self.names = {}
+        self.buffer = bytearray(MAGIC)
+        self.last_flush = time.monotonic()
+
+    def name_id(self, name):
+        if name not in self.names:
+            self.names[name] = len(self.names)
+            encoded = name.encode('utf-8')
+            self.buffer += NAME + _name_header.pack(self.names[name], len(encoded)) + encoded
+        return self.names[name]
+
+    def expected_cost(self, contract, fun, expected_cost):
+        encoded = str(expected_cost).encode('utf-8')
+        self.buffer += EXPECTED + _expected_header.pack(
+            self.name_id(contract), self.name_id(fun), len(encoded)) + encoded
+        self.maybe_flush()
+
+    def calls(self, contract, fun, gas_costs, outcome='success'):
+        contract_id, fun_id = self.name_id(contract), self.name_id(fun)
+        tag = OUTCOME_TAGS[outcome]
+        for gas_cost in gas_costs:
+            self.buffer += tag + _call.pack(contract_id, fun_id, gas_cost)
+        self.maybe_flush()
+
+    def call(self, contract, fun, gas_cost, outcome='success'):
+        self.calls(contract, fun, (gas_cost,), outcome)
+
+    def maybe_flush(self):
+        if len(self.buffer) >= self.buffer_size or time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        self.file.write(self.buffer)
+        self.file.flush()
+        self.buffer = bytearray()
+        self.last_flush = time.monotonic()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+
+def read_stream(path, chunk_size=2 ** 20):
+    '''Yields the records of a results stream as (tag, contract, function, value) tuples.
+    The stream is read in chunks of chunk_size bytes, so only a chunk is held in memory.
+    A truncated last record, left by an interrupted run, is ignored.
+    '''
+    with open(path, 'rb') as file:
+        data = file.read(max(chunk_size, len(MAGIC)))
+        if data[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a results stream")
+
+        names = {}
+        offset = len(MAGIC)
+
+        while True:
+            record, end = _parse_record(data, offset, names, path)
+            if end is None:
+                # The chunk ends in the middle of a record
+                more = file.read(chunk_size)
+                if not more:
+                    return
+                data, offset = data[offset:] + more, 0
+                continue
+
+            offset = end
+            if record is not None:
+                yield record
+
+
+def _parse_record(data, offset, names, path):
+    '''Parses the record at offset. Returns the record, or None for names, and the offset after it,
+    which is None if data ends before the record does.
+    '''
+    if offset >= len(data):
+        return None, None
+
+    tag = data[offset:offset + 1]
+    offset += 1
+
+    if tag in TAG_OUTCOMES:
+        if offset + _call.size > len(data):
+            return None, None
+        contract_id, fun_id, gas_cost = _call.unpack_from(data, offset)
+        return (tag, names[contract_id], names[fun_id], gas_cost), offset + _call.size
+    elif tag == NAME:
+        if offset + _name_header.size > len(data):
+            return None, None
+        name_id, length = _name_header.unpack_from(data, offset)
+        offset += _name_header.size
+        if offset + length > len(data):
+            return None, None
+        names[name_id] = data[offset:offset + length].decode('utf-8')
+        return None, offset + length
+    elif tag == EXPECTED:
+        if offset + _expected_header.size > len(data):
+            return None, None
+        contract_id, fun_id, length = _expected_header.unpack_from(data, offset)
+        offset += _expected_header.size
+        if offset + length > len(data):
+            return None, None
+        value = data[offset:offset + length].decode('utf-8')
+        return (EXPECTED, names[contract_id], names[fun_id], value), offset + length
+    else:
+        raise ValueError(f"Unknown record {tag} in {path}")
+
+
+def split_streams(paths, folder, buffer_size=2 ** 16):
+    '''Splits the calls of the given results streams into files in folder, one per function,
+    so their costs can be exported a function at a time instead of loading every call.
+    Returns the base path of the files of each (contract, function), to be read with load_split.
+    '''
+    buffers = {}
+    split = {}
+
+    def flush(key):
+        costs, outcomes = buffers.pop(key)
+        with open(split[key] + ".costs", 'ab') as file:
+            costs.tofile(file)
+        with open(split[key] + ".outcomes", 'ab') as file:
+            outcomes.tofile(file)
+
+    for path in paths:
+        for tag, contract, fun, value in read_stream(path):
+            if tag == EXPECTED:
+                continue
+
+            key = (contract, fun)
+            if key not in split:
+                split[key] = os.path.join(folder, str(len(split)))
+            if key not in buffers:
+                buffers[key] = (array('Q'), array('B'))
+            costs, outcomes = buffers[key]
+            costs.append(value)
+            outcomes.append(TAG_OUTCOMES[tag])
+            if len(costs) >= buffer_size:
+                flush(key)
+
+    for key in list(buffers):
+        flush(key)
+
+    return split
+
+
+def load_split(path):
+    '''Returns the costs of a function split by split_streams, and the outcomes of their calls as indices of OUTCOMES
+    '''
+    costs = array('Q')
+    with open(path + ".costs", 'rb') as file:
+        costs.frombytes(file.read())
+    outcomes = array('B')
+    with open(path + ".outcomes", 'rb') as file:
+        outcomes.frombytes(file.read())
+    return costs, outcomes
@@ -0,0 +1,69 @@
+import json
+from queue import Queue, Empty
+from threading import Thread
+
+# Fields of every trace record, in the order given to TraceWriter.record
+FIELDS = ('block', 'contract', 'function', 'caller', 'value', 'args', 'gas', 'status')
+
+
+class TraceWriter():
+    '''Writes a JSON line for every call of a simulation, from a background thread.
+    The fuzzing loop only queues the raw values of each call. Encoding them and writing to the file
+    is done by the writer thread, in batches of up to batch_size calls.
+    '''
+    def __init__(self, path, simulation=None, batch_size=512, flush_interval=1.0):
+        self.file = open(path, 'w')
+        self.simulation = simulation
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self.queue = Queue()
+        self.thread = Thread(target=self.run, name="Trace writer", daemon=True)
+        self.thread.start()
+
+    def record(self, block, contract, function, caller, value, args, gas, status):
+        '''Queues a call. caller and args are bytes, args being the ABI encoded arguments.
+        '''
+        self.queue.put((block, contract, function, caller, value, args, gas, status))
+
+    def encode(self, call):
+        record = dict(zip(FIELDS, call))
+        record['simulation'] = self.simulation
+        record['caller'] = '0x' + record['caller'].hex()
+        record['args'] = '0x' + record['args'].hex()
+        return json.dumps(record) + '\n'
+
+    def run(self):
+        closed = False
+        while not closed:
+            try:
+                batch = [self.queue.get(timeout=self.flush_interval)]
+            except Empty:
+                continue
+
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except Empty:
+                    break
+
+            # None is queued by close, after the last call
+            if batch[-1] is None:
+                closed = True
+                batch.pop()
+
+            self.file.writelines(self.encode(call) for call in batch)
+            self.file.flush()
+
+    def close(self):
+        '''Writes the queued calls and closes the file
+        '''
+        self.queue.put(None)
+        self.thread.join()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
@@ -1,11 +1,14 @@
 from parsing.instantiators import instantiate_rules
 from exceptions import InvalidLogicException
-from random import choice
+from random import Random
 import logging
 
 
 class BaseTypeFuzzer():
-    def __init__(self, rules=None, rule_closures=None, argname=None, contract_state_vars=[], **kwargs):
+    def __init__(self, rules=None, rule_closures=None, argname=None, contract_state_vars=[], rng=None, **kwargs):
+        # Source of the generated values, shared with the SolidityFuzzer that owns this fuzzer
+        self.rng = rng if rng is not None else Random()
+
         self.rules = instantiate_rules(rules, str(
             self), self) if rules is not None else []
 
@@ -57,7 +60,8 @@ class BaseTypeFuzzer():
     def next_valid(self):
         value = self.next()
 
-        logging.debug(f"Fuzzer ({self.pretty_str()}) generated value {value}.")
+        if logging.root.isEnabledFor(logging.DEBUG):
+            logging.debug(f"Fuzzer ({self.pretty_str()}) generated value {value}.")
 
         # Throws if invalid
         self.validate(value)
@@ -6,8 +6,6 @@ from .primitive_types import (
     CharFuzzer
 )
 
-from random import expovariate
-
 class DynamicLengthFuzzer(BaseTypeFuzzer):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
@@ -16,7 +14,7 @@ class DynamicLengthFuzzer(BaseTypeFuzzer):
         return value
 
     def get_length(self):
-        return int(expovariate(1 / 64)) + 1
+        return int(self.rng.expovariate(1 / 64)) + 1
 
 class DynamicArrayFuzzer(ArrayFuzzer, DynamicLengthFuzzer):
     def __init__(self, subtype, **kwargs):
@@ -1,5 +1,6 @@
 from .base import BaseTypeFuzzer
 import logging
+import numpy
 
 class NumericTypeFuzzer(BaseTypeFuzzer):
     def __init__(self, min=None, max=None, **kwargs):
@@ -7,8 +8,80 @@ class NumericTypeFuzzer(BaseTypeFuzzer):
         self.base_max = max
         self.min = min if callable(min) else lambda: min
         self.max = max if callable(max) else lambda: max
+
+        # Values generated by next_batch that haven't been used yet
+        self._prefetched = []
+        # Created on the first batch that fits in 64 bits, seeded from self.rng
+        self._numpy_rng = None
+
         super().__init__(**kwargs)
 
+    def next(self):
+        if self.constant() is not None:
+            return self.constant()
+
+        low, high = self.min(), self.max()
+        excluded = {exc() for exc in self._except}
+
+        while True:
+            val = self.rng.randint(low, high)
+            if val not in excluded:
+                return val
+
+    def next_batch(self, n):
+        '''Generates n values at once, within the current bounds and without the avoided values
+        '''
+        if self.constant() is not None:
+            return [self.constant()] * n
+
+        low, high = int(self.min()), int(self.max())
+        excluded = {exc() for exc in self._except}
+
+        values = []
+        while len(values) < n:
+            values += [
+                val for val in self.random_integers(low, high, n - len(values))
+                if val not in excluded
+            ]
+
+        return values
+
+    def random_integers(self, low, high, n):
+        '''Draws n integers uniformly from [low, high]
+        '''
+        if -2 ** 63 <= low and high < 2 ** 63:
+            dtype = numpy.int64
+        elif 0 <= low and high < 2 ** 64:
+            dtype = numpy.uint64
+        else:
+            dtype = None
+
+        if dtype is not None:
+            if self._numpy_rng is None:
+                self._numpy_rng = numpy.random.default_rng(self.rng.getrandbits(64))
+            return self._numpy_rng.integers(low, high, size=n, dtype=dtype, endpoint=True).tolist()
+
+        span = high - low + 1
+        if span & (span - 1) == 0:
+            # The full range of a type, random bits need no rejection
+            bits = span.bit_length() - 1
+            return [low + self.rng.getrandbits(bits) for _ in range(n)]
+
+        return [low + self.rng.randrange(span) for _ in range(n)]
+
+    def prefetchable(self):
+        '''Whether values can be generated ahead of time.
+        Only true without rules, since constraint bounds may depend on the contract's state
+        '''
+        return len(self.rules) == 0
+
+    def next_prefetched(self, batch_size):
+        '''Returns the next value of a buffer refilled with next_batch
+        '''
+        if not self._prefetched:
+            self._prefetched = self.next_batch(batch_size)
+        return self._prefetched.pop()
+
     def greater_than(self, valueThunk):
         '''Set this fuzzer to generate values greater than to value
         '''
@@ -1,5 +1,3 @@
-from random import randint, choice, getrandbits
-
 from decimal import Decimal
 
 from string import printable
@@ -22,15 +20,6 @@ class UIntFuzzer(NumericTypeFuzzer):
         assert value < 2 ** self.bits, f"{self} values must be lower than {2 ** self.bits - 1}. (got {value})"
         return value
 
-    def next(self):
-        if self.constant() is not None:
-            return self.constant()
-
-        while True:
-            val = randint(self.min(), self.max())
-            if val not in [exc() for exc in self._except]:
-                return val
-
     def __str__(self):
         return "uint"
 
@@ -52,15 +41,6 @@ class IntFuzzer(NumericTypeFuzzer):
         assert value < 2 ** (self.bits - 1), f"{self} values must be lower than {2 ** (self.bits - 1)}. (got {value})"
         return value
 
-    def next(self):
-        if self.constant() is not None:
-            return self.constant()
-
-        while True:
-            val = randint(self.min(), self.max())
-            if val not in [exc() for exc in self._except]:
-                return val
-
     def __str__(self):
         return "int"
 
@@ -89,6 +69,12 @@ class AddressFuzzer(UIntFuzzer):
             if val not in [exception() for exception in self._except]:
                 return val.to_bytes(length=20, byteorder='big')
 
+    def next_batch(self, n):
+        if self.constant() is not None:
+            return [self.constant()] * n
+
+        return [val.to_bytes(length=20, byteorder='big') for val in super().next_batch(n)]
+
 
 class BoolFuzzer(BaseTypeFuzzer):
     def __init__(self, **kwargs):
@@ -102,7 +88,7 @@ class BoolFuzzer(BaseTypeFuzzer):
         return True in self._except() and False in self._except()
 
     def next(self):
-        return choice([True, False])
+        return self.rng.choice([True, False])
 
     def __str__(self):
         return "bool"
@@ -120,7 +106,7 @@ class UFixedFuzzer(BaseTypeFuzzer):
         return value
 
     def next(self):
-        return Decimal(randint(0, 2 ** self.m_bits - 1)) / Decimal(10 ** self.n_bits)
+        return Decimal(self.rng.randint(0, 2 ** self.m_bits - 1)) / Decimal(10 ** self.n_bits)
 
     def __str__(self):
         return "ufixed"
@@ -139,7 +125,7 @@ class FixedFuzzer(UFixedFuzzer):
         return value
 
     def next(self):
-        return Decimal(randint(-2 ** (self.m_bits - 1), 2 ** (self.m_bits - 1) - 1)) / Decimal(10 ** self.n_bits)
+        return Decimal(self.rng.randint(-2 ** (self.m_bits - 1), 2 ** (self.m_bits - 1) - 1)) / Decimal(10 ** self.n_bits)
 
     def __str__(self):
         return "fixed"
@@ -155,7 +141,7 @@ class BytesFuzzer(BaseTypeFuzzer):
         return value
 
     def next(self):
-        return bytearray(getrandbits(8) for _ in range(self.byte_n))
+        return bytearray(self.rng.getrandbits(8) for _ in range(self.byte_n))
 
     def __str__(self):
         return f"bytes{self.byte_n}"
@@ -197,4 +183,4 @@ class CharFuzzer(BaseTypeFuzzer):
         return value
 
     def next(self):
-        return choice(printable)
+        return self.rng.choice(printable)
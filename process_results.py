@@ -1,25 +1,169 @@
-import sys
 import os
+import sys
+import argparse
+import mmap
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import matplotlib
+# Plots are only saved to files, no display is needed
+matplotlib.use('Agg')
 import matplotlib.pyplot as plt
 import seaborn as sn
 import pandas as pd
 
-if len(sys.argv) < 2:
-    print("Call script with root folder of the results")
-    sys.exit(1)
-
-def get_range(expected_cost, costs):
-        min_cost = min(costs)
-        max_cost = max(costs)
-        if expected_cost != 'infinite':
-            exp_cost = int(expected_cost)
-            if exp_cost < min_cost:
-                return (exp_cost, max_cost + 10)
-            elif exp_cost > max_cost:
-                return (min_cost - 10, exp_cost)
-        return (min_cost - 10, max_cost + 10)
-
-def graph(result_path, expected_cost, actual_costs):
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "gas_fuzz"))
+from results_store import ResultsStore
+from fuzzing_data import OUTCOMES
+
+KEYS = ['file', 'contract', 'function']
+
+EXPECTED_COST_CLASSIFICATIONS = [
+    'less_than',
+    'greater_than',
+    'none',
+    'equal'
+]
+
+ACTUAL_COST_CLASSIFICATIONS = [
+    'constant',
+    'decreasing',
+    'increasing',
+    'other'
+]
+
+# Bytes of a result file parsed at once
+CHUNK_SIZE = 2 ** 26
+
+def read_result(path):
+    '''Reads the expected cost and the gas costs of a result file.
+    The file is memory mapped and parsed by NumPy in chunks, without creating a Python object per line
+    or loading the whole file into memory.
+    '''
+    with open(path, 'rb') as file:
+        expected_cost = file.readline().decode('utf-8').strip()
+        offset = file.tell()
+        size = os.fstat(file.fileno()).st_size
+        if size == offset:
+            return expected_cost, np.array([], dtype=np.int64)
+
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            chunks = [np.array([], dtype=np.int64)]
+            while offset < size:
+                # Chunks end at a line break, so no number is split between them
+                end = mapped.find(b'\n', min(offset + CHUNK_SIZE, size) - 1)
+                end = size if end == -1 else end + 1
+                chunk = mapped[offset:end]
+                if not chunk.isspace():
+                    chunks.append(np.fromstring(chunk, dtype=np.int64, sep='\n'))
+                offset = end
+
+    return expected_cost, np.concatenate(chunks)
+
+def results_frames(expected, costs, outcomes):
+    '''Builds the frame of costs, one row per call with its outcome, and the frame of functions,
+    with their expected cost and the time their results were last modified.
+    outcomes holds the outcome of every cost, as indices of OUTCOMES.
+    '''
+    expected = pd.DataFrame(expected, columns=KEYS + ['expected', 'mtime'])
+    lengths = [len(actual_costs) for actual_costs in costs]
+    data = pd.DataFrame({
+        key: pd.Categorical(np.repeat(expected[key].values, lengths)) for key in KEYS
+    })
+    data['cost'] = np.concatenate(costs) if costs else np.array([], dtype=np.int64)
+    data['outcome'] = pd.Categorical.from_codes(
+        np.concatenate(outcomes) if outcomes else np.array([], dtype=np.int8), categories=OUTCOMES)
+    return data, expected
+
+def load_store(path):
+    '''Loads the results saved to a ResultsStore database
+    '''
+    expected = []
+    costs = []
+    outcomes = []
+    with ResultsStore(path) as store:
+        for file, contract, function, expected_cost, blob, outcomes_blob, updated in store.functions():
+            expected.append((file, contract, function, expected_cost, updated))
+            costs.append(np.frombuffer(blob, dtype='<u8').astype(np.int64))
+            outcomes.append(np.frombuffer(outcomes_blob, dtype=np.uint8).astype(np.int8))
+    return results_frames(expected, costs, outcomes)
+
+def load_results(results_root):
+    '''Loads every result file under results_root.
+    The costs of failed calls are in files with their outcome as extension, next to the file of the function.
+    '''
+    functions = {}
+    for root, dirs, results in os.walk(results_root):
+        for result in results:
+            relative_path = os.path.join(root, result)
+            file, contract, name = os.path.relpath(relative_path, results_root).split(os.sep)
+            function, _, outcome = name.partition('.')
+            expected_cost, actual_costs = read_result(relative_path)
+
+            key = (file, contract, function)
+            if key not in functions:
+                functions[key] = [expected_cost, 0, [], []]
+            function_results = functions[key]
+            function_results[1] = max(function_results[1], os.path.getmtime(relative_path))
+            function_results[2].append(actual_costs)
+            function_results[3].append(np.full(len(actual_costs), OUTCOMES.index(outcome or 'success'), dtype=np.int8))
+
+    expected = [key + (expected_cost, mtime) for key, (expected_cost, mtime, _, _) in functions.items()]
+    costs = [np.concatenate(function_costs) for _, _, function_costs, _ in functions.values()]
+    outcomes = [np.concatenate(function_outcomes) for _, _, _, function_outcomes in functions.values()]
+    return results_frames(expected, costs, outcomes)
+
+def successful(data):
+    '''Costs of the calls that succeeded
+    '''
+    return data[data['outcome'] == 'success']
+
+def classify(data, expected):
+    '''Classifies every function by its expected cost against the average actual cost of its successful calls,
+    and by the trend of the frequencies of those costs.
+    Returns a summary frame with one row per function with successful calls, and its number of failed calls.
+    '''
+    failures = data.groupby(KEYS + ['outcome'], observed=True).size().unstack('outcome', fill_value=0)
+    failures = failures.reindex(columns=OUTCOMES[1:], fill_value=0).rename_axis(columns=None).reset_index()
+
+    data = successful(data)
+    summary = data.groupby(KEYS, observed=True)['cost'].agg(['count', 'mean', 'min', 'max']).reset_index()
+    summary = summary.merge(expected, on=KEYS, how='left')
+    summary = summary.merge(failures, on=KEYS, how='left')
+
+    # Frequency of every distinct cost, sorted by cost within each function
+    frequencies = data.groupby(KEYS + ['cost'], observed=True).size()
+    steps = frequencies.groupby(level=KEYS, observed=True).diff()
+    trends = pd.DataFrame({
+        'distinct': frequencies.groupby(level=KEYS, observed=True).size(),
+        'decreasing': (steps.fillna(0) <= 0).groupby(level=KEYS, observed=True).all(),
+        'increasing': (steps.fillna(0) >= 0).groupby(level=KEYS, observed=True).all(),
+    }).reset_index()
+    summary = summary.merge(trends, on=KEYS, how='left')
+
+    expected_cost = pd.to_numeric(summary['expected'], errors='coerce')
+    summary['exp_class'] = np.select(
+        [expected_cost.isna(), expected_cost < summary['mean'], expected_cost > summary['mean']],
+        ['none', 'less_than', 'greater_than'],
+        default='equal'
+    )
+    summary['cost_class'] = np.select(
+        [summary['distinct'] == 1, summary['decreasing'], summary['increasing']],
+        ['constant', 'decreasing', 'increasing'],
+        default='other'
+    )
+    return summary.drop(columns=['distinct', 'decreasing', 'increasing']).sort_values(KEYS, ignore_index=True)
+
+def get_range(expected_cost, min_cost, max_cost):
+    if expected_cost != 'infinite':
+        exp_cost = int(expected_cost)
+        if exp_cost < min_cost:
+            return (exp_cost, max_cost + 10)
+        elif exp_cost > max_cost:
+            return (min_cost - 10, exp_cost)
+    return (min_cost - 10, max_cost + 10)
+
+def graph(result_path, function_summary, actual_costs):
+    expected_cost = function_summary['expected']
     leg = []
     if expected_cost != "infinite":
         plt.axvline(
@@ -29,13 +173,17 @@ def graph(result_path, expected_cost, actual_costs):
             zorder=-1
         )
         leg.append("Expected cost")
-    plt.hist(x=actual_costs, range=get_range(expected_cost, actual_costs), color=(100/255, 100/255, 1, 0.8))
+    plt.hist(
+        x=actual_costs,
+        range=get_range(expected_cost, function_summary['min'], function_summary['max']),
+        color=(100/255, 100/255, 1, 0.8)
+    )
     plt.xlabel("Gas cost")
     plt.ylabel("Frequency")
-    plt.title(f"Gas costs of {contract}.{function}")
+    plt.title(f"Gas costs of {function_summary['contract']}.{function_summary['function']}")
 
     plt.axvline(
-        x=sum(actual_costs) / len(actual_costs),
+        x=function_summary['mean'],
         color=(150/255, 1, 150/255, 0.8),
         linestyle='-',
         zorder=-1
@@ -43,76 +191,61 @@ def graph(result_path, expected_cost, actual_costs):
     leg.append("Average cost")
     plt.legend(leg)
 
-    exp, cost = classify(expected_cost, actual_costs)
-
-    plt.figtext(0.5, 0.05, f"Classified as ({exp}, {cost})", wrap = True, horizontalalignment="center", weight='ultralight')
+    plt.figtext(
+        0.5, 0.05,
+        f"Classified as ({function_summary['exp_class']}, {function_summary['cost_class']})",
+        wrap = True, horizontalalignment="center", weight='ultralight'
+    )
 
     plt.gcf().subplots_adjust(bottom=0.2)
 
-    result_dir = os.path.dirname(result_path)
-    if not os.path.exists(result_dir):
-        os.makedirs(result_dir)
+    os.makedirs(os.path.dirname(result_path), exist_ok=True)
 
     plt.savefig(result_path)
     plt.close()
 
+def plot_path(function_summary):
+    return f"processed_results/{function_summary['file']}/{function_summary['contract']}/{function_summary['function']}.png"
 
-def frequencies(costs):
-    return {
-        cost: costs.count(cost) for cost in set(costs)
-    }
-
-def decreasing(frequencies):
-    prev_freq = max(frequencies.values())
-    for cost in sorted(frequencies.keys()):
-        if frequencies[cost] > prev_freq:
-            return False
-        prev_freq = frequencies[cost]
-    return True
-
-def increasing(frequencies):
-    prev_freq = 0
-    for cost in sorted(frequencies.keys()):
-        if frequencies[cost] < prev_freq:
-            return False
-        prev_freq = frequencies[cost]
-    return True
-
-def classify(expected_cost, actual_costs):
-    avg = sum(actual_costs) / len(actual_costs)
-    if expected_cost == "infinite":
-        exp_class = "none"
-    elif int(expected_cost) < avg:
-        exp_class = "less_than"
-    elif int(expected_cost) > avg:
-        exp_class = "greater_than"
-    else:
-        exp_class = "equal"
+def up_to_date(function_summary):
+    '''Whether the plot of a function is newer than its results
+    '''
+    save_path = plot_path(function_summary)
+    return os.path.exists(save_path) and os.path.getmtime(save_path) >= function_summary['mtime']
 
-    freq = frequencies(actual_costs)
+def graph_job(job):
+    graph(*job)
 
-    if len(freq.keys()) == 1:
-        cost_class = "constant"
-    elif decreasing(freq):
-        cost_class = "decreasing"
-    elif increasing(freq):
-        cost_class = "increasing"
-    else:
-        cost_class = "other"
-    
-    return exp_class, cost_class
-
-def plot_classifications(classifications):
-    array = [
-        [
-            count for count in cost_classifiations.values()
-        ] for cost_classifiations in classifications.values()
+def plot_functions(data, summary, jobs=1):
+    '''Renders the plot of every function whose results changed since its last plot.
+    With more than one job, plots are rendered in a pool of processes.
+    Returns the number of rendered plots.
+    '''
+    costs_by_function = data.groupby(KEYS, observed=True)['cost']
+    graphs = [
+        (
+            plot_path(function_summary),
+            function_summary,
+            costs_by_function.get_group(tuple(function_summary[key] for key in KEYS)).values
+        ) for function_summary in summary.to_dict('records')
+        if not up_to_date(function_summary)
     ]
 
-    exps = list(classifications.keys())
-    costs = list(classifications['none'].keys())
+    if jobs > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            list(executor.map(graph_job, graphs, chunksize=max(1, len(graphs) // (jobs * 4))))
+    else:
+        for job in graphs:
+            graph_job(job)
+
+    return len(graphs)
 
-    df = pd.DataFrame(array, exps, costs)
+def plot_classifications(summary):
+    df = pd.crosstab(summary['exp_class'], summary['cost_class']).reindex(
+        index=EXPECTED_COST_CLASSIFICATIONS,
+        columns=ACTUAL_COST_CLASSIFICATIONS,
+        fill_value=0
+    ).rename_axis(index=None, columns=None)
     plt.figure(figsize=(10,7))
     sn.set(font_scale=1.4)
     sn.heatmap(df, annot=True, annot_kws={"size": 16})
@@ -123,40 +256,23 @@ def plot_classifications(classifications):
 
 
 if __name__ == "__main__":
-    results_root = sys.argv[1]
-
-    expected_cost_classifications = [
-        'less_than',
-        'greater_than',
-        'none',
-        'equal'
-    ]
-
-    actual_cost_classifications = [
-        'constant',
-        'decreasing',
-        'increasing',
-        "other"
-    ]
+    parser = argparse.ArgumentParser(description="Classifies and plots the results of gas fuzzing")
+    parser.add_argument("results", help="root folder of the results, or a results database saved with --store")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="number of processes rendering plots")
+    parser.add_argument("--no-plots", action='store_true',
+                        help="only classify the results, without plotting every function")
+    args = parser.parse_args()
 
-    classifications = {
-        exp_class: {
-            cost_class: 0 for cost_class in actual_cost_classifications
-        } for exp_class in expected_cost_classifications
-    }
-
-    for root, dirs, results in os.walk(results_root):
-        for result in results:
-            relative_path = f"{root}/{result}"
-            _, file, contract, function = relative_path.split(os.sep)
-            save_path = f"processed_results/{file}/{contract}/{function}.png"
-            with open(relative_path) as func_results:
-                expected_cost = func_results.readline()
-                actual_costs = [int(actual_cost) for actual_cost in func_results]
-
-            graph(save_path, expected_cost, actual_costs)            
+    if os.path.isfile(args.results):
+        data, expected = load_store(args.results)
+    else:
+        data, expected = load_results(args.results)
+    summary = classify(data, expected)
 
-            exp, cost = classify(expected_cost, actual_costs)
-            classifications[exp][cost] += 1
+    if not args.no_plots:
+        rendered = plot_functions(successful(data), summary, jobs=args.jobs)
+        print(f"Rendered {rendered} of {len(summary)} plots")
 
-    plot_classifications(classifications)
\ No newline at end of file
+    summary.drop(columns=['mtime']).to_csv("summary.csv", index=False)
+    plot_classifications(summary)